@@ -0,0 +1,131 @@
+import argparse
+import wave
+from array import array
+from collections import deque
+
+from core import Core
+
+#Beeper driven by the sound timer, producing one block of 16 bit mono PCM per frame
+#The core calls Sound.frame after every frame (it goes in Core.on_frame), which hands the sink
+#either the tone or silence for that frame, so beeps start and stop on frame boundaries. A frame
+#beeps when the sound timer was running during it, so FX18 with N beeps for N frames
+#Every block is computed up front: with a whole number of blocks per second and a tone in whole
+#Hz, the tone repeats every second, so a frame's block only depends on its position in the
+#second. Nothing is computed or allocated while running, a frame is one list lookup
+
+class Sound:
+    sink = None
+    block_size = None #Samples per frame
+    tone = None #One block per frame of a second
+    silence = None
+    position = 0 #Frames so far
+
+    def __init__(self, sink, sample_rate=44100, frame_hz=60, tone_hz=440, volume=0.25):
+        if sample_rate % frame_hz:
+            raise ValueError(f"{sample_rate}Hz can't be split evenly into {frame_hz} frames per second")
+        self.sink = sink
+        self.block_size = sample_rate // frame_hz
+        #Square wave, high for the first half of every period
+        amplitude = round(volume*32767)
+        second = array('h', (
+            amplitude if (i*tone_hz*2 // sample_rate) % 2 == 0 else -amplitude
+            for i in range(sample_rate)
+        ))
+        self.tone = [
+            second[start:start+self.block_size].tobytes()
+            for start in range(0, sample_rate, self.block_size)
+        ]
+        self.silence = bytes(2*self.block_size)
+        self.position = 0
+
+    def frame(self, core):
+        if core.sound_on:
+            self.sink.write(self.tone[self.position % len(self.tone)])
+        else:
+            self.sink.write(self.silence)
+        self.position += 1
+
+#Sinks take blocks of 16 bit mono PCM through write(block), which must never block the core
+
+class NullSink:
+    def write(self, block):
+        pass
+
+    def close(self):
+        pass
+
+class WavSink:
+    file = None
+
+    def __init__(self, file_name, sample_rate=44100):
+        self.file = wave.open(file_name, 'wb')
+        self.file.setnchannels(1)
+        self.file.setsampwidth(2)
+        self.file.setframerate(sample_rate)
+
+    def write(self, block):
+        self.file.writeframesraw(block)
+
+    #Fixes up the header with the final length
+    def close(self):
+        self.file.close()
+
+#Plays through the sound card with sounddevice (optional dependency)
+#write only appends to a short queue that the audio callback takes blocks from, dropping the
+#oldest ones when the core runs ahead and playing silence when it falls behind
+class LiveSink:
+    stream = None
+    queue = None
+    silence = None
+
+    def __init__(self, sample_rate=44100, frame_hz=60, latency_frames=3):
+        import sounddevice
+        block_size = sample_rate // frame_hz
+        self.queue = deque(maxlen=latency_frames)
+        self.silence = bytes(2*block_size)
+        self.stream = sounddevice.RawOutputStream(
+            samplerate=sample_rate, blocksize=block_size, channels=1, dtype='int16', callback=self.callback
+        )
+        self.stream.start()
+
+    def write(self, block):
+        self.queue.append(block)
+
+    def callback(self, outdata, frames, time, status):
+        try:
+            outdata[:] = self.queue.popleft()
+        except IndexError:
+            outdata[:] = self.silence
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+#Run a ROM headless for a number of frames and write its audio to a WAV file
+def render(rom, file_name, frames, quirks=None, sample_rate=44100, **settings):
+    core = Core()
+    core.load(rom)
+    core.configure(quirks if quirks is not None else dict(Core.quirks), throttle=False, **settings)
+    core.reset()
+    sink = WavSink(file_name, sample_rate)
+    sound = Sound(sink, sample_rate, core.display_hz)
+    try:
+        for _ in range(frames):
+            core.run_frames(1)
+            sound.frame(core)
+    finally:
+        sink.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a ROM's audio to a WAV file")
+    parser.add_argument('rom')
+    parser.add_argument('output')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file:
+        rom = file.read()
+    render(rom, args.output, round(args.seconds*60), seed=args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+import numpy as np
+
+from core import Core, FONT
+
+#Runs N instances of the same ROM in lockstep, with the state of every instance kept in NumPy arrays
+#Each step fetches one instruction per instance, groups the instances by the opcode's first digit
+#and runs each group's instructions across all of its instances at once
+#Opcode semantics and quirks match Core; the only differences are that CXNN uses a per-instance
+#xorshift generator, and an instance that would crash Core (returning with an empty stack, reading
+#or writing outside of RAM, overflowing the stack) is halted instead
+
+class BatchCore:
+    n = None #Number of instances
+    binary_data = None
+
+    #Settings
+    clk_hz = None
+    display_hz = None
+    cycles_per_frame = None
+    quirks = None
+    stack_depth = None
+
+    #State, one row per instance
+    ram = None #N x 4096 uint8
+    r_v = None #N x 16 uint8
+    pc = None
+    r_i = None
+    stack = None #N x stack_depth
+    sp = None
+    display_data = None #N x 32 uint64, same layout as Core's rows
+    delay_timer = None
+    sound_timer = None
+    keys = None #Bitmask of the keys pressed on each instance, set by the caller
+    key_wait = None #Keys held since FX0A started waiting, -1 when it isn't waiting
+    vblank_wait = None #Whether a sprite draw with the display_wait quirk is waiting for the next tick
+    halted = None
+    rng_state = None
+    seeds = None
+
+    cycles = 0 #Steps since reset, shared by every instance
+
+    def __init__(self, n, quirks:dict=None, clk_hz=720, display_hz=60, seeds=None, stack_depth=16):
+        self.n = n
+        self.quirks = dict(quirks if quirks is not None else Core.quirks)
+        self.clk_hz = clk_hz
+        self.display_hz = display_hz
+        self.cycles_per_frame = max(round(clk_hz / display_hz), 1)
+        self.stack_depth = stack_depth
+        if seeds is None:
+            seeds = np.arange(1, n+1)
+        #xorshift can't leave 0
+        self.seeds = np.where(np.asarray(seeds, dtype=np.uint32) == 0, 1, seeds).astype(np.uint32)
+
+    def setup(self, file_name):
+        with open(file_name, 'rb') as file:
+            self.load(file.read())
+
+    def load(self, binary_data):
+        self.binary_data = binary_data
+
+    def reset(self):
+        n = self.n
+        self.ram = np.zeros((n, 4096), dtype=np.uint8)
+        self.ram[:, :len(FONT)*5] = np.array(FONT, dtype=np.uint8).reshape(-1)
+        self.ram[:, 0x200:0x200+len(self.binary_data)] = np.frombuffer(self.binary_data, dtype=np.uint8)
+        self.r_v = np.zeros((n, 16), dtype=np.uint8)
+        self.pc = np.full(n, 0x200, dtype=np.int64)
+        self.r_i = np.zeros(n, dtype=np.int64)
+        self.stack = np.zeros((n, self.stack_depth), dtype=np.int64)
+        self.sp = np.zeros(n, dtype=np.int64)
+        self.display_data = np.zeros((n, 32), dtype=np.uint64)
+        self.delay_timer = np.zeros(n, dtype=np.int64)
+        self.sound_timer = np.zeros(n, dtype=np.int64)
+        self.keys = np.zeros(n, dtype=np.int64)
+        self.key_wait = np.full(n, -1, dtype=np.int64)
+        self.vblank_wait = np.zeros(n, dtype=bool)
+        self.halted = np.zeros(n, dtype=bool)
+        self.rng_state = self.seeds.copy()
+        self.cycles = 0
+
+    #Same as Core's
+    def run_cycles(self, n):
+        for _ in range(n):
+            self.step()
+            self.cycles += 1
+            if self.cycles % self.cycles_per_frame == 0:
+                self.tick_timers()
+
+    def run_frames(self, n):
+        self.run_cycles(n*self.cycles_per_frame)
+
+    def tick_timers(self):
+        np.subtract(self.delay_timer, 1, out=self.delay_timer, where=self.delay_timer > 0)
+        np.subtract(self.sound_timer, 1, out=self.sound_timer, where=self.sound_timer > 0)
+        self.vblank_wait[:] = False
+
+    #Rows of an instance's display, as Core.display_data
+    def display_rows(self, i):
+        return [int(row) for row in self.display_data[i]]
+
+    #Run one instruction on every instance that isn't halted
+    def step(self):
+        #Fetching past the end of RAM is the first way to crash
+        self.halted |= self.pc + 1 >= 4096
+        #Instances waiting for vblank sit out the rest of the frame, like Core skipping ahead
+        running = np.flatnonzero(~(self.halted | self.vblank_wait))
+        if running.size == 0:
+            return
+        pc = self.pc[running]
+        inst = (self.ram[running, pc].astype(np.int64) << 8) | self.ram[running, pc+1]
+        #PC is moved to the next instruction before executing, like Core
+        self.pc[running] = pc + 2
+
+        family = inst >> 12
+        order = np.argsort(family, kind='stable')
+        bounds = np.searchsorted(family[order], np.arange(17))
+        for f in range(16):
+            group = order[bounds[f]:bounds[f+1]]
+            if group.size:
+                self.families[f](self, running[group], inst[group])
+
+    #Opcode families, each gets the instances running it and their instructions
+
+    def family_0(self, idx, inst):
+        clear = idx[inst == 0x00E0]
+        self.display_data[clear] = 0
+        self.ret(idx[inst == 0x00EE])
+        call = (inst != 0x00E0) & (inst != 0x00EE)
+        self.call(idx[call], inst[call] & 0xFFF)
+
+    def family_1(self, idx, inst):
+        self.pc[idx] = inst & 0xFFF
+
+    def family_2(self, idx, inst):
+        self.call(idx, inst & 0xFFF)
+
+    def family_3(self, idx, inst):
+        self.skip(idx, self.r_v[idx, (inst >> 8) & 0xF] == (inst & 0xFF))
+
+    def family_4(self, idx, inst):
+        self.skip(idx, self.r_v[idx, (inst >> 8) & 0xF] != (inst & 0xFF))
+
+    def family_5(self, idx, inst):
+        self.skip(idx, self.r_v[idx, (inst >> 8) & 0xF] == self.r_v[idx, (inst >> 4) & 0xF])
+
+    def family_6(self, idx, inst):
+        self.r_v[idx, (inst >> 8) & 0xF] = inst & 0xFF
+
+    def family_7(self, idx, inst):
+        x = (inst >> 8) & 0xF
+        self.r_v[idx, x] = (self.r_v[idx, x].astype(np.int64) + (inst & 0xFF)) & 0xFF
+
+    def family_8(self, idx, inst):
+        x = (inst >> 8) & 0xF
+        y = (inst >> 4) & 0xF
+        n = inst & 0xF
+        vx = self.r_v[idx, x].astype(np.int64)
+        vy = self.r_v[idx, y].astype(np.int64)
+        if self.quirks['shifting']:
+            #Shifts VX in place instead of VY
+            shifted = vx
+        else:
+            shifted = vy
+        res = np.select(
+            [n == 0x0, n == 0x1, n == 0x2, n == 0x3, n == 0x4, n == 0x5, n == 0x6, n == 0x7, n == 0xE],
+            [vy, vx | vy, vx & vy, vx ^ vy, vx + vy, vx - vy, shifted >> 1, vy - vx, shifted << 1],
+            vx
+        )
+        known = np.isin(n, (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE))
+        self.r_v[idx[known], x[known]] = res[known] & 0xFF
+        #VF is written last so it wins when X is F
+        flag = np.select(
+            [n == 0x4, (n == 0x5) | (n == 0x7), n == 0x6, n == 0xE],
+            [res >> 8, (res >= 0).astype(np.int64), shifted & 0b1, shifted >> 7],
+            0
+        )
+        sets_flag = np.isin(n, (0x4, 0x5, 0x6, 0x7, 0xE))
+        if self.quirks['vf_reset']:
+            sets_flag |= np.isin(n, (0x1, 0x2, 0x3))
+        self.r_v[idx[sets_flag], 0xF] = flag[sets_flag]
+
+    def family_9(self, idx, inst):
+        self.skip(idx, self.r_v[idx, (inst >> 8) & 0xF] != self.r_v[idx, (inst >> 4) & 0xF])
+
+    def family_a(self, idx, inst):
+        self.r_i[idx] = inst & 0xFFF
+
+    def family_b(self, idx, inst):
+        #Jumping quirk reads the offset from VX instead of V0
+        x = (inst >> 8) & 0xF if self.quirks['jumping'] else 0
+        self.pc[idx] = (inst & 0xFFF) + self.r_v[idx, x]
+
+    def family_c(self, idx, inst):
+        #xorshift32
+        state = self.rng_state[idx]
+        state ^= state << np.uint32(13)
+        state ^= state >> np.uint32(17)
+        state ^= state << np.uint32(5)
+        self.rng_state[idx] = state
+        self.r_v[idx, (inst >> 8) & 0xF] = (state >> np.uint32(24)).astype(np.int64) & (inst & 0xFF)
+
+    def family_d(self, idx, inst):
+        x = self.r_v[idx, (inst >> 8) & 0xF].astype(np.int64) % 64
+        y = self.r_v[idx, (inst >> 4) & 0xF].astype(np.int64) % 32
+        #Like Core's RAM slice, a sprite is cut short at the end of RAM
+        height = np.minimum(inst & 0xF, np.maximum(4096 - self.r_i[idx], 0))
+        if self.quirks['clipping']:
+            height = np.minimum(height, 32 - y)
+        collision = np.zeros(idx.size, dtype=bool)
+        for j in range(15):
+            drawing = j < height
+            if not drawing.any():
+                break
+            rows_idx = idx[drawing]
+            byte = self.ram[rows_idx, self.r_i[rows_idx] + j].astype(np.uint64)
+            xs = x[drawing].astype(np.uint64)
+            if self.quirks['clipping']:
+                #Bits that go past the right edge are shifted out
+                bits = np.where(
+                    xs <= 56,
+                    byte << (np.uint64(56) - np.minimum(xs, np.uint64(56))),
+                    byte >> (np.maximum(xs, np.uint64(56)) - np.uint64(56))
+                )
+            else:
+                #Bits that go past the right edge come back from the left
+                bits = (byte << np.uint64(56)) >> xs
+                wrapped = byte << (np.uint64(120) - np.maximum(xs, np.uint64(57)))
+                bits |= np.where(xs > 56, wrapped, np.uint64(0))
+            row = (y[drawing] + j) % 32
+            current = self.display_data[rows_idx, row]
+            collision[drawing] |= (current & bits) != 0
+            self.display_data[rows_idx, row] = current ^ bits
+        self.r_v[idx, 0xF] = collision
+        if self.quirks['display_wait']:
+            self.vblank_wait[idx] = True
+
+    def family_e(self, idx, inst):
+        vx = self.r_v[idx, (inst >> 8) & 0xF].astype(np.int64)
+        #Only keys 0-F can ever be pressed
+        pressed = (vx < 16) & (((self.keys[idx] >> (vx & 0xF)) & 1) == 1)
+        op = inst & 0xFF
+        self.skip(idx, ((op == 0x9E) & pressed) | ((op == 0xA1) & ~pressed))
+
+    def family_f(self, idx, inst):
+        x = (inst >> 8) & 0xF
+        op = inst & 0xFF
+        r_v = self.r_v
+
+        sel = op == 0x07
+        r_v[idx[sel], x[sel]] = self.delay_timer[idx[sel]]
+
+        sel = op == 0x0A
+        if sel.any():
+            waiting = idx[sel]
+            keys = self.keys[waiting]
+            held = np.maximum(self.key_wait[waiting], 0) | keys
+            released = held & ~keys
+            has_key = released != 0
+            #Lowest released key, run this instruction again when there's none
+            lowest = np.zeros(waiting.size, dtype=np.int64)
+            for key in range(15, -1, -1):
+                lowest = np.where((released >> key) & 1 == 1, key, lowest)
+            r_v[waiting[has_key], x[sel][has_key]] = lowest[has_key]
+            self.key_wait[waiting] = np.where(has_key, -1, held)
+            self.pc[waiting[~has_key]] -= 2
+
+        sel = op == 0x15
+        self.delay_timer[idx[sel]] = r_v[idx[sel], x[sel]]
+        sel = op == 0x18
+        self.sound_timer[idx[sel]] = r_v[idx[sel], x[sel]]
+        sel = op == 0x1E
+        self.r_i[idx[sel]] += r_v[idx[sel], x[sel]]
+        sel = op == 0x29
+        self.r_i[idx[sel]] = (r_v[idx[sel], x[sel]].astype(np.int64) % 0x10)*5
+
+        sel = op == 0x33
+        if sel.any():
+            bcd = idx[sel]
+            inside = self.r_i[bcd] + 2 < 4096
+            self.halted[bcd[~inside]] = True
+            bcd = bcd[inside]
+            v = r_v[bcd, x[sel][inside]].astype(np.int64)
+            i = self.r_i[bcd]
+            self.ram[bcd, i] = v // 100
+            self.ram[bcd, i+1] = (v % 100) // 10
+            self.ram[bcd, i+2] = v % 10
+
+        for op_code in (0x55, 0x65):
+            sel = op == op_code
+            if not sel.any():
+                continue
+            copy = idx[sel]
+            count = x[sel] + 1
+            inside = self.r_i[copy] + count <= 4096
+            self.halted[copy[~inside]] = True
+            copy = copy[inside]
+            count = count[inside]
+            i = self.r_i[copy]
+            for k in range(16):
+                active = k < count
+                if not active.any():
+                    break
+                if op_code == 0x55:
+                    self.ram[copy[active], i[active] + k] = r_v[copy[active], k]
+                else:
+                    r_v[copy[active], k] = self.ram[copy[active], i[active] + k]
+            if self.quirks['memory']:
+                self.r_i[copy] += count
+
+    families = [
+        family_0, family_1, family_2, family_3, family_4, family_5, family_6, family_7,
+        family_8, family_9, family_a, family_b, family_c, family_d, family_e, family_f
+    ]
+
+    #Helpers
+
+    def skip(self, idx, condition):
+        self.pc[idx[condition]] += 2
+
+    def call(self, idx, target):
+        overflow = self.sp[idx] >= self.stack_depth
+        self.halted[idx[overflow]] = True
+        idx = idx[~overflow]
+        self.stack[idx, self.sp[idx]] = self.pc[idx]
+        self.sp[idx] += 1
+        self.pc[idx] = target[~overflow]
+
+    def ret(self, idx):
+        empty = self.sp[idx] == 0
+        self.halted[idx[empty]] = True
+        idx = idx[~empty]
+        self.sp[idx] -= 1
+        self.pc[idx] = self.stack[idx, self.sp[idx]]
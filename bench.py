@@ -0,0 +1,207 @@
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+
+from core import Core
+from renderers import TerminalRenderer, TkRenderer
+
+#Benchmarks for the core and the renderer
+#Every result is a flat "group/name" key with a single number, so runs can be saved as JSON
+#and compared against each other with --compare
+
+QUIRKS_CLIP = dict(Core.quirks, display_wait=False, clipping=True)
+QUIRKS_WRAP = dict(Core.quirks, display_wait=False, clipping=False)
+
+#Synthetic ROMs
+
+def assemble(*insts):
+    return b''.join(inst.to_bytes(2, 'big') for inst in insts)
+
+#Setup, then the same instruction repeated, then a jump back to the start
+#Going back through the setup keeps instructions that move I from running off the end of RAM
+def repeat_rom(inst, setup=(), count=32):
+    return assemble(*setup, *[inst]*count, 0x1200)
+
+#Arithmetic and logic on registers only
+ALU_LOOP = assemble(
+    0x7001, 0x7102, 0x8014, 0x8125, 0x8236, 0x830E, 0x8441, 0x8552,
+    0xA300, 0xF21E, 0x6607, 0x6709, 0x1200
+)
+#Draws 8 tall sprites all over the screen, wrapping X and Y around
+SPRITE_STORM = assemble(
+    0xA000, 0x6000, 0x6100,
+    0xD018, 0x7007, 0x7103, 0xF01E, 0x3F00, 0x00E0,
+    0x1206
+)
+#BCD of a counter stored and loaded back
+MEMORY_CHURN = assemble(
+    0x6000,
+    0xA300, 0xF033, 0xF265, 0xA310, 0xF355, 0xA310, 0xF365, 0x7001,
+    0x1202
+)
+
+#Opcode classes, each one with the setup it needs to be repeated safely
+OPCODE_CLASSES = {
+    '6XNN': (0x6012, ()),
+    '7XNN': (0x7001, ()),
+    '8XY0': (0x8010, ()),
+    '8XY4': (0x8014, ()),
+    '8XY6': (0x8016, ()),
+    '3XNN': (0x3001, ()), #never skips
+    'ANNN': (0xA300, ()),
+    'CXNN': (0xC0FF, ()),
+    'DXYN': (0xD015, ()),
+    'EX9E': (0xE09E, ()), #no key is ever pressed, never skips
+    'FX07': (0xF007, ()),
+    'FX1E': (0xF01E, (0xA300,)),
+    'FX33': (0xF033, (0xA300,)),
+    'FX55': (0xFF55, (0xA300,)),
+    'FX65': (0xFF65, (0xA300,)),
+}
+
+def setup_core(rom, quirks=QUIRKS_CLIP, translate=False):
+    core = Core()
+    core.load(rom)
+    core.configure(quirks, throttle=False, translate=translate)
+    core.reset()
+    return core
+
+#Measurement
+
+#Best rate over a few repeats, in units of count per second
+def best_rate(run, count, repeats):
+    best = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = max(best, count / elapsed)
+    return best
+
+def bench_opcodes(results, cycles, repeats):
+    for name, (inst, setup) in OPCODE_CLASSES.items():
+        core = setup_core(repeat_rom(inst, setup))
+        results[f"opcode/{name}/ips"] = best_rate(lambda: core.run_cycles(cycles), cycles, repeats)
+
+#Every height is drawn where it fits whole, so clipped and wrapped draws do the same work,
+#then a 15 row sprite at the bottom right corner measures the clipping or wrapping itself
+def bench_dxyn(results, draws, repeats):
+    cases = [(f"h{height}", 28, 8, height) for height in (1, 4, 8, 15)] + [("edge/h15", 60, 28, 15)]
+    for quirks, clip_name in ((QUIRKS_CLIP, 'clip'), (QUIRKS_WRAP, 'wrap')):
+        core = setup_core(assemble(0x1200), quirks)
+        core.r_i = 0x0
+        for name, x, y, height in cases:
+            core.r_v[0] = x
+            core.r_v[1] = y
+            draw = core.op(0xD010 | height)
+            def run():
+                for _ in range(draws):
+                    draw()
+            rate = best_rate(run, draws, repeats)
+            results[f"dxyn/{clip_name}/{name}/us"] = 1e6 / rate
+
+def bench_roms(results, cycles, repeats):
+    roms = {'alu_loop': ALU_LOOP, 'sprite_storm': SPRITE_STORM, 'memory_churn': MEMORY_CHURN}
+    for name, rom in roms.items():
+        for translate, engine in ((False, 'interpreter'), (True, 'blocks')):
+            core = setup_core(rom, translate=translate)
+            #Starts from reset every time, so translating the blocks is part of the measurement
+            def run():
+                core.reset()
+                core.run_cycles(cycles)
+            results[f"rom/{name}/{engine}/cps"] = best_rate(run, cycles, repeats)
+
+#The Tk ones need a display, they're skipped when Tk can't open a window
+def bench_render(results, frames, repeats):
+    #Frames the sprite storm ROM actually draws
+    core = setup_core(SPRITE_STORM)
+    sequence = []
+    for _ in range(frames):
+        core.run_cycles(12)
+        sequence.append(list(core.display_data))
+
+    def run():
+        renderer = TerminalRenderer(io.StringIO())
+        for display_data in sequence:
+            renderer.present(display_data)
+    rate = best_rate(run, len(sequence), repeats)
+    results["render/terminal/ms"] = 1000 / rate
+
+    try:
+        from tkinter import Tk, Canvas
+        tk = Tk()
+    except Exception as e:
+        print(f"Skipping Tk render benchmarks: {e}", file=sys.stderr)
+        return
+    for scale in (1, 2, 4, 8, 16):
+        renderer = TkRenderer(tk, Canvas(tk), scale)
+        def run():
+            for display_data in sequence:
+                renderer.present(display_data)
+            tk.update()
+        rate = best_rate(run, len(sequence), repeats)
+        results[f"render/scale{scale}/ms"] = 1000 / rate
+    tk.destroy()
+
+BENCHMARKS = {
+    'opcode': lambda results, args: bench_opcodes(results, args.cycles, args.repeats),
+    'dxyn': lambda results, args: bench_dxyn(results, args.draws, args.repeats),
+    'rom': lambda results, args: bench_roms(results, args.cycles, args.repeats),
+    'render': lambda results, args: bench_render(results, args.frames, args.repeats),
+}
+
+#Print each result next to the one from a previous run
+def compare(results, file_name):
+    with open(file_name) as file:
+        previous = json.load(file)['results']
+    for key, value in results.items():
+        if key in previous and previous[key]:
+            #Times are better when lower, rates when higher
+            ratio = value / previous[key]
+            if key.endswith(('/us', '/ms')):
+                ratio = 1 / ratio
+            print(f"{key:40} {previous[key]:14.2f} -> {value:14.2f} ({ratio:.2f}x)")
+        else:
+            print(f"{key:40} {'':14} -> {value:14.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Cheep8 benchmarks")
+    parser.add_argument('groups', nargs='*', help=f"Benchmarks to run, any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--cycles', type=int, default=100_000)
+    parser.add_argument('--draws', type=int, default=20_000)
+    parser.add_argument('--frames', type=int, default=240)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON file from a previous run to compare against")
+    args = parser.parse_args()
+    for group in args.groups:
+        if group not in BENCHMARKS:
+            parser.error(f"unknown benchmark {group}")
+
+    results = {}
+    for group in args.groups or BENCHMARKS:
+        BENCHMARKS[group](results, args)
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    if args.compare:
+        compare(results, args.compare)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,82 @@
-from random import randrange
-import queue
+from random import Random, randrange
+from functools import partial
 import logging
-import time
 
 # from display import Display
-from kb_input import KB_Input
+from headless import NullDisplay, NullInput
 from timer import Timer
+from tracer import Tracer
+from profiler import Profiler
+from scheduler import FrameScheduler
+from translator import BlockCache
 
 #References:
 #https://github.com/mattmikolay/chip-8/wiki/CHIP%E2%80%908-Technical-Reference
 #https://github.com/mattmikolay/chip-8/wiki/CHIP%E2%80%908-Instruction-Set
 #https://github.com/Timendus/chip8-test-suite (Tests 4 and 5 helped a lot)
 
+#Font data has 5 bytes per digit and starts at 0x000
+FONT = [
+    [0xF0, 0x90, 0x90, 0x90, 0xF0], #0
+    [0x20, 0x60, 0x20, 0x20, 0x70], #1
+    [0xF0, 0x10, 0xF0, 0x80, 0xF0], #2
+    [0xF0, 0x10, 0xF0, 0x10, 0xF0], #3
+    [0x90, 0x90, 0xF0, 0x10, 0x10], #4
+    [0xF0, 0x80, 0xF0, 0x10, 0xF0], #5
+    [0xF0, 0x80, 0xF0, 0x90, 0xF0], #6
+    [0xF0, 0x10, 0x20, 0x40, 0x40], #7
+    [0xF0, 0x90, 0xF0, 0x90, 0xF0], #8
+    [0xF0, 0x90, 0xF0, 0x10, 0xF0], #9
+    [0xF0, 0x90, 0xF0, 0x90, 0x90], #A
+    [0xE0, 0x90, 0xE0, 0x90, 0xE0], #B
+    [0xF0, 0x80, 0x80, 0x80, 0xF0], #C
+    [0xE0, 0x90, 0x90, 0x90, 0xE0], #D
+    [0xF0, 0x80, 0xF0, 0x80, 0xF0], #E
+    [0xF0, 0x80, 0xF0, 0x80, 0x80]  #F
+]
+
+#Raised by an instruction that closes a loop which can only be left by a timer tick
+#(when timed) or an input change, so the core can skip ahead instead of spinning through it
+class IdleLoop(Exception):
+    length = None #Instructions per iteration
+    timed = None
+
+    def __init__(self, length, timed):
+        self.length = length
+        self.timed = timed
+
+#Raised by a sprite draw with the display_wait quirk, which then waits for vblank: nothing else
+#runs in the frame, the core skips ahead to the next timer tick
+class VBlankWait(IdleLoop):
+    def __init__(self):
+        super().__init__(1, True)
+
 class Core():
     binary_data = None
 
     #Emulator systems
-    display_queue = None
+    display = None
     kb_input = None
     delay_timer = None
     sound_timer = None
+    tracer = None #Only set when debugging
+    profiler = None #Only set when profiling
+    record = None #Called with (pc, inst, I, V) before every instruction when tracing or profiling
+    blocks = None #Only set when translating code into blocks
+    scheduler = None #Only set while running throttled
+    running = False #Cleared by stop to make run return at the end of the frame
+    on_frame = None #Called with the core after every frame run executes
 
     #Settings
     clk_hz = None #Target frequency
     display_hz = None
-    epoch_size = None #Number of instructions before the core cares about target frequency and sleeps
+    throttle = True #Wait for each frame's deadline to meet clk_hz, otherwise run as fast as possible
+    max_catch_up = None #Number of late frames the core tries to make up for before dropping them
+    seed = None #Seed for CXNN's random numbers, a different one on every reset when None
+    #Skip idle loops and vblank waits in bulk. Without it every cycle is dispatched on its own,
+    #like a plain interpreter, which is what verify checks the faster engines against
+    fast_forward = True
+    cycles_per_frame = None #Number of instructions between each timer tick
     #Quirks (default = CHIP8)
     quirks = {
         'vf_reset': True,
@@ -43,50 +95,98 @@ class Core():
     r_v = None
     stack = None
 
-    def __init__(self, display_queue : queue.Queue, display_hz=60):
+    rng = None #Random numbers for CXNN
+    rng_seed = None #Seed the current run started with, so it can be repeated
+
+    #Handler for each opcode, built by build_ops
+    #ops[inst]() may only be called with the PC right after inst, since an entry that's still
+    #undecoded reads inst back through the PC (see decode_op). Code that calls a handler without
+    #syncing the PC has to decode it first with op(inst)
+    ops = None
+    undecoded = None #Stands in for the handlers in ops that haven't been decoded yet
+    cycles = 0 #Instructions executed since reset
+    idle_cycles = 0 #Instructions skipped by fast-forwarding idle loops, already counted in cycles
+    vblank_wait = False #Whether a sprite draw is waiting for vblank, until the next timer tick
+    vblank_waits = 0 #Sprite draws that waited for vblank, so run can tell which frames ended with one
+    key_wait = None #release_count when FX0A started waiting for a key, None when it isn't waiting
+    sound_on = False #Whether the sound timer was running at the end of the last frame, before its tick
+
+    #Display and input default to a null implementation, so a core built without arguments is headless
+    #display needs publish and kb_input needs keys/release_count/last_released
+    def __init__(self, display=None, kb_input=None, display_hz=60):
         self.display_hz = display_hz
-        self.display_queue = display_queue
-        self.kb_input = KB_Input()
-        self.delay_timer = Timer(self.display_hz)
+        self.display = display if display is not None else NullDisplay()
+        self.kb_input = kb_input if kb_input is not None else NullInput()
+        self.delay_timer = Timer()
+        self.sound_timer = Timer()
+        self.on_frame = []
+        self.rng = Random()
     
-    def setup(self, file_name, quirks:dict, clk_hz=720, epoch_size=10, debug=False):
-        self.clk_hz = clk_hz
-        self.epoch_size = epoch_size
+    def setup(self, file_name, quirks:dict, **settings):
         #Load program
         with open(file_name, 'rb') as file:
-            self.binary_data = file.read()
+            self.load(file.read())
+        self.configure(quirks, **settings)
+
+    #Same as setup, for a program that's already loaded
+    def configure(self, quirks:dict, clk_hz=720, max_catch_up=4, debug=False, throttle=True, translate=False,
+            profile=False, seed=None, fast_forward=True):
+        if translate and not fast_forward:
+            raise ValueError("Translated blocks always fast forward")
+        self.clk_hz = clk_hz
+        self.seed = seed
+        self.fast_forward = fast_forward
+        self.max_catch_up = max_catch_up
+        self.throttle = throttle
+        self.cycles_per_frame = max(round(clk_hz / self.display_hz), 1)
         if debug:
             logging.basicConfig(level=logging.DEBUG)
+            self.tracer = Tracer()
+        else:
+            self.tracer = None
+        self.profiler = Profiler(self) if profile else None
+        if self.tracer is not None and self.profiler is not None:
+            tracer_record = self.tracer.record
+            profiler_record = self.profiler.record
+            def record(pc, inst, r_i, r_v):
+                tracer_record(pc, inst, r_i, r_v)
+                profiler_record(pc, inst, r_i, r_v)
+            self.record = record
+        elif self.tracer is not None:
+            self.record = self.tracer.record
+        elif self.profiler is not None:
+            self.record = self.profiler.record
+        else:
+            self.record = None
         
-        self.quirks = quirks
+        #Switching ROMs keeps the handlers, and changing quirks only rebuilds the ones they affect
+        quirks = dict(quirks)
+        if self.ops is None:
+            self.quirks = quirks
+            self.ops = self.build_ops()
+        elif quirks != self.quirks:
+            self.quirks = quirks
+            self.build_quirk_ops()
+        #Blocks have the quirks baked in, so they're always started from scratch
+        self.blocks = BlockCache(self) if translate else None
     
     #Initialize 64x32 screen data
+    #Each row is a 64 bit int, with the leftmost pixel as the most significant bit
+    #Both are cleared in place once they exist, so a reset doesn't allocate anything
     def init_screen(self):
-        self.display_data = [[0]*64 for _ in range(32)]
+        if self.display_data is None:
+            self.display_data = [0]*32
+        else:
+            self.display_data[:] = [0]*32
     
     def init_ram(self):
         #4096 bytes of RAM
-        self.ram = bytearray(4096)
-        font = [
-            [0xF0, 0x90, 0x90, 0x90, 0xF0], #0
-            [0x20, 0x60, 0x20, 0x20, 0x70], #1
-            [0xF0, 0x10, 0xF0, 0x80, 0xF0], #2
-            [0xF0, 0x10, 0xF0, 0x10, 0xF0], #3
-            [0x90, 0x90, 0xF0, 0x10, 0x10], #4
-            [0xF0, 0x80, 0xF0, 0x10, 0xF0], #5
-            [0xF0, 0x80, 0xF0, 0x90, 0xF0], #6
-            [0xF0, 0x10, 0x20, 0x40, 0x40], #7
-            [0xF0, 0x90, 0xF0, 0x90, 0xF0], #8
-            [0xF0, 0x90, 0xF0, 0x10, 0xF0], #9
-            [0xF0, 0x90, 0xF0, 0x90, 0x90], #A
-            [0xE0, 0x90, 0xE0, 0x90, 0xE0], #B
-            [0xF0, 0x80, 0x80, 0x80, 0xF0], #C
-            [0xE0, 0x90, 0x90, 0x90, 0xE0], #D
-            [0xF0, 0x80, 0xF0, 0x80, 0xF0], #E
-            [0xF0, 0x80, 0xF0, 0x80, 0x80]  #F
-        ]
+        if self.ram is None:
+            self.ram = bytearray(4096)
+        else:
+            self.ram[:] = bytes(4096)
         i = 0
-        for c in font:
+        for c in FONT:
             for line in c:
                 self.ram[i] = line
                 i += 1
@@ -94,11 +194,14 @@ class Core():
     def skip_next(self):
         self.pc += 2
 
-    def run(self):
+    def load(self, binary_data):
+        self.binary_data = binary_data
+
+    #Initialize every structure and load the program into memory
+    def reset(self):
         self.init_screen()
         self.init_ram()
-        self.display_queue.put(self.display_data)
-        self.display_queue.join()
+        self.display.publish(self.display_data)
         #Program Counter
         self.pc = 0x200
         #Address register
@@ -107,291 +210,590 @@ class Core():
         self.r_v = [0]*16
         #Stack
         self.stack = []
+        self.cycles = 0
+        self.idle_cycles = 0
+        self.key_wait = None
+        self.vblank_wait = False
+        self.sound_on = False
+        self.rng_seed = self.seed if self.seed is not None else randrange(1 << 32)
+        self.rng.seed(self.rng_seed)
+        self.delay_timer.timer = 0
+        self.sound_timer.timer = 0
 
         #Load program into memory
         self.ram[0x200:(0x200+len(self.binary_data))] = self.binary_data
+        if self.blocks is not None:
+            self.blocks.clear()
+        if self.profiler is not None:
+            self.profiler.reset()
+
+    #Headless API, runs the already reset core without any pacing
+
+    #Run a single instruction and return it
+    def step(self):
+        return self.run_cycles(1)
+
+    #Run n instructions and return the last one
+    #Timers tick every cycles_per_frame instructions, so they follow the executed program
+    #instead of the wall clock
+    def run_cycles(self, n):
+        #Tracing and profiling need every instruction, so they take priority over running blocks
+        if self.record is not None:
+            execute = self.execute_recorded
+        elif self.blocks is not None:
+            return self.execute_blocks(n)
+        else:
+            execute = self.execute
+        inst = None
+        end = self.cycles + n
+        while self.cycles < end:
+            next_tick = (self.cycles // self.cycles_per_frame + 1)*self.cycles_per_frame
+            limit = min(end, next_tick) if self.fast_forward else self.cycles + 1
+            if self.vblank_wait:
+                self.wait_vblank(limit)
+            else:
+                inst = execute(limit - self.cycles)
+            if self.cycles == next_tick:
+                self.tick_timers()
+        return inst
+
+    #Run n frames' worth of instructions
+    def run_frames(self, n):
+        return self.run_cycles(n*self.cycles_per_frame)
+
+    def tick_timers(self):
+        #Frame callbacks run after the tick, by then FX18 with 1 would already be back to 0
+        self.sound_on = self.sound_timer.timer > 0
+        self.delay_timer.tick()
+        self.sound_timer.tick()
+        self.vblank_wait = False
+
+    #Runs frame by frame: cycles_per_frame instructions (which ends with a timer tick), then a
+    #wait until the frame's deadline. Drawing already published the frame
+    #Keeps going until stop is called, resetting the core first unless told otherwise
+    def run(self, reset=True):
+        if reset:
+            self.reset()
+        self.running = True
+
+        if self.throttle:
+            self.scheduler = FrameScheduler(self.display_hz, max_catch_up=self.max_catch_up)
+            self.scheduler.start()
+        else:
+            self.scheduler = None
+        try:
+            while self.running:
+                vblank_waits = self.vblank_waits
+                inst = self.run_cycles(self.cycles_per_frame)
+                for callback in self.on_frame:
+                    callback(self)
+                if not self.throttle:
+                    continue
+
+                missed_frames = self.scheduler.missed_frames
+                sleep_time = self.scheduler.wait()
+                if self.scheduler.missed_frames != missed_frames:
+                    logging.warning(
+                        f"Dropped {self.scheduler.missed_frames - missed_frames} frames, too far behind to meet "
+                        f"{self.clk_hz}Hz ({self.cycles_per_frame} cycles per frame):\r\n"
+                        f"Last instruction: {inst:x}"
+                    )
+                if self.profiler is not None:
+                    #A frame that ends waiting for a key or for vblank spent its sleep waiting on
+                    #the user or on the ROM's own one sprite per frame limit
+                    if self.key_wait is not None:
+                        self.profiler.add_epoch(0, sleep_time, 0)
+                    elif self.vblank_waits != vblank_waits:
+                        self.profiler.add_epoch(sleep_time, 0, 0)
+                    else:
+                        self.profiler.add_epoch(0, 0, sleep_time)
+        except Exception:
+            if self.tracer is not None:
+                logging.error("Last instructions before crashing:\r\n" + "\r\n".join(self.tracer.lines(16)))
+            raise
+
+    #Can be called from any thread
+    def stop(self):
+        self.running = False
 
-        #Epoch initialization
-        epoch_counter = 0
-        epoch_start = time.time()
-        epoch_display_time = 0
-        epoch_input_time = 0
-        while True:
-            inst = int.from_bytes(self.ram[self.pc:self.pc+2])
-            prev_inst = inst
-            logging.debug(f" inst={inst:x}, PC={self.pc:x}, I={self.r_i:x}")
-            display_updated = False
-            jumping = False
-            if inst == 0x00E0:
-                display_updated = True
-                self.init_screen()
-                logging.debug(f"00E0 Clear screen")
-            elif inst == 0x00EE:
-                self.pc = self.stack.pop()
-                logging.debug(f"00EE Returned")
-            elif inst <= 0x0FFF:
-                self.stack.append(self.pc)
-                self.pc = inst
-                logging.debug(f"{inst:x} Execute Machine Subroutine")
-                jumping = True
-            elif inst >= 0x1000 and inst <= 0x1FFF:
-                self.pc = inst % 0x1000
-                logging.debug(f"{inst:x} Jump")
-                jumping = True
-            elif inst >= 0x2000 and inst <= 0x2FFF:
-                self.stack.append(self.pc)
-                self.pc = inst % 0x2000
-                logging.debug(f"{inst:x} Execute Subroutine")
-                jumping = True
-            elif inst >= 0x3000 and inst <= 0x3FFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                n = inst % 0x100 #3rd and 4th digits
-                if self.r_v[x] == n:
-                    self.skip_next()
-                logging.debug(f"Skip if V{x:x} ({self.r_v[x]}) == {n}")
-            elif inst >= 0x4000 and inst <= 0x4FFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                n = inst % 0x100 #3rd and 4th digits
-                if self.r_v[x] != n:
-                    self.skip_next()
-                logging.debug(f"Skip if V{x:x} ({self.r_v[x]}) != {n}")
-            elif inst >= 0x5000 and inst <= 0x5FFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                y = (inst % 0x100) // 0x10 #3rd digit
-                if inst % 0x10 != 0:
-                    logging.warning(f"Unexpected digit {inst % 0x10:x} at the end of 0x5XY0 op")
-                if self.r_v[x] == self.r_v[y]:
-                    self.skip_next()
-                logging.debug(f"Skip if V{x:x} ({self.r_v[x]}) != V{y:x} ({self.r_v[y]})")
-            elif inst >= 0x6000 and inst <= 0x6FFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                n = inst % 0x100 #3rd and 4th digits
-                self.r_v[x] = n
-                logging.debug(f"Store {n:x} in V{x:x}")
-            elif inst >= 0x7000 and inst <= 0x7FFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                n = inst % 0x100 #3rd and 4th digits
-                self.r_v[x] += n
-                self.r_v[x] %= 0b1_0000_0000 #Restrict itself to 8 bits
-                logging.debug(f"{inst:x} V{x:x} += {n:x}")
-            elif inst >= 0x8000 and inst <= 0x8FFF: #TEST 0x7
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                inst %= 0x100
-                y = inst // 0x10 #3rd digit
-                op = inst % 0x10 #4th digit
-                match op:
+    #Run n instructions, returns the last one
+    def execute(self, n):
+        ops = self.ops
+        ram = self.ram
+        try:
+            for done in range(1, n+1):
+                pc = self.pc
+                inst = (ram[pc] << 8) | ram[pc+1]
+                #PC is moved to the next instruction before executing, so jumps just overwrite it
+                #and skips only need to add 2 more
+                self.pc = pc + 2
+                ops[inst]()
+        except IdleLoop as idle:
+            leftover = self.skip_idle(idle, n, done)
+            return self.execute(leftover) if leftover else inst
+        self.cycles += n
+        return inst
+
+    #Same as execute, but records every instruction first
+    def execute_recorded(self, n):
+        ops = self.ops
+        ram = self.ram
+        record = self.record
+        try:
+            for done in range(1, n+1):
+                pc = self.pc
+                inst = (ram[pc] << 8) | ram[pc+1]
+                record(pc, inst, self.r_i, self.r_v)
+                self.pc = pc + 2
+                ops[inst]()
+        except IdleLoop as idle:
+            leftover = self.skip_idle(idle, n, done)
+            return self.execute_recorded(leftover) if leftover else inst
+        self.cycles += n
+        return inst
+
+    #n is always within a single timer tick, so an idle loop would just keep repeating until
+    #the end of it. Skip every whole iteration left and return how many instructions still need to run
+    def skip_idle(self, idle, n, done):
+        skipped = (n - done) - (n - done) % idle.length
+        self.cycles += done + skipped
+        self.idle_cycles += skipped
+        if self.profiler is not None and skipped and not isinstance(idle, VBlankWait):
+            self.profiler.record_idle(self.pc, idle.length, skipped // idle.length)
+        return n - done - skipped
+
+    #Skip ahead to limit (at most the next timer tick) while a sprite draw waits for vblank
+    def wait_vblank(self, limit):
+        self.idle_cycles += limit - self.cycles
+        self.cycles = limit
+
+    #Raise IdleLoop if the loop closed by jumping back to start can only be left by
+    #a timer tick or an input change
+    #The jump might have been reached some other way than falling through the loop's test, so
+    #the test is evaluated as the next iteration will see it, and only a loop that is sure to
+    #come back here is skipped
+    def check_idle(self, start, distance):
+        if distance == 0:
+            #Jumping to itself
+            raise IdleLoop(1, False)
+        ram = self.ram
+        first = (ram[start] << 8) | ram[start+1]
+        x = (first >> 8) & 0xF
+        if distance == 2:
+            #EX9E/EXA1 followed by a jump back to it, polling a key that doesn't make it skip
+            held = self.kb_input.keys & (1 << self.r_v[x])
+            if (first & 0xF0FF == 0xE09E and not held) or (first & 0xF0FF == 0xE0A1 and held):
+                raise IdleLoop(2, False)
+        else:
+            #FX07, then 3XNN/4XNN on the same VX, then a jump back to it, polling the delay timer
+            #until the test skips. VX also has to hold the current timer value, or the timer ticked
+            #since it was read and skipping iterations would leave VX behind
+            second = (ram[start+2] << 8) | ram[start+3]
+            if not (first & 0xF0FF == 0xF007 and second >> 12 in (0x3, 0x4) and (second >> 8) & 0xF == x):
+                return
+            timer = self.delay_timer.timer
+            skips = (timer == second & 0xFF) if second >> 12 == 0x3 else (timer != second & 0xFF)
+            if self.r_v[x] == timer and not skips:
+                raise IdleLoop(3, True)
+
+    #Update display after a relevant instruction
+    #Publishing never waits for the renderer, it just picks up the newest frame when it refreshes
+    def update_display(self):
+        self.display.publish(self.display_data)
+
+    #Same as run_cycles, but runs a whole translated block per dispatch
+    #A block that touches the timers only runs if it ends before the next tick, so it sees them
+    #exactly like single instructions would. Any other block can go past ticks, which are then
+    #caught up right after it
+    def execute_blocks(self, n):
+        get_block = self.blocks.get
+        ops = self.ops
+        r_v = self.r_v
+        ram = self.ram
+        inst = None
+        end = self.cycles + n
+        next_tick = (self.cycles // self.cycles_per_frame + 1)*self.cycles_per_frame
+        while self.cycles < end:
+            if self.vblank_wait:
+                self.wait_vblank(min(end, next_tick))
+                while self.cycles >= next_tick:
+                    self.tick_timers()
+                    next_tick += self.cycles_per_frame
+                continue
+            block = get_block(self.pc)
+            block_end = self.cycles + block.length
+            if block_end <= end and (block_end <= next_tick or not block.timed):
+                try:
+                    block.run(self, r_v, ram, ops)
+                    self.cycles = block_end
+                except IdleLoop as idle:
+                    #Only a block's last instruction can close an idle loop
+                    limit = min(end, next_tick) if idle.timed else end
+                    skipped = max(limit - block_end, 0) // idle.length * idle.length
+                    self.cycles = block_end + skipped
+                    self.idle_cycles += skipped
+                inst = block.last_inst
+            else:
+                inst = self.execute(1)
+            while self.cycles >= next_tick:
+                self.tick_timers()
+                next_tick += self.cycles_per_frame
+        return inst
+
+    #Decoding
+
+    #Handlers are built once per opcode, with their operands already decoded and quirks
+    #already resolved, so running an instruction is just a lookup and a call
+    #A ROM only ever runs a few hundred of the 65536 opcodes, so they start out undecoded and
+    #each one is decoded the first time it runs, instead of all of them before the first instruction
+    def build_ops(self):
+        self.undecoded = self.decode_op
+        return [self.undecoded]*0x10000
+
+    #Runs in place of a handler that hasn't been decoded yet. The PC has already been moved
+    #past the instruction, which is how it finds out what to decode: called with the PC
+    #anywhere else, it decodes and runs whatever instruction is there instead
+    def decode_op(self):
+        pc = self.pc - 2
+        self.op((self.ram[pc] << 8) | self.ram[pc+1])()
+
+    #Handler for an opcode, decoded if it hasn't been yet
+    def op(self, inst):
+        op = self.ops[inst]
+        if op is self.undecoded:
+            op = self.ops[inst] = self.decode(inst)
+        return op
+
+    #Only 8XY1-3/6/E, BNNN, DXYN and FX55/65 have quirks
+    QUIRK_INSTS = (
+        [inst for inst in range(0x8000, 0x9000) if inst & 0xF in (0x1, 0x2, 0x3, 0x6, 0xE)]
+        + list(range(0xB000, 0xC000)) + list(range(0xD000, 0xE000))
+        + [0xF000 | (x << 8) | nn for x in range(16) for nn in (0x55, 0x65)]
+    )
+
+    #Their handlers go back to undecoded, to be decoded with the new quirks when they next run
+    def build_quirk_ops(self):
+        ops = self.ops
+        for inst in self.QUIRK_INSTS:
+            ops[inst] = self.undecoded
+
+    def decode(self, inst):
+        x = (inst >> 8) & 0xF #2nd digit
+        y = (inst >> 4) & 0xF #3rd digit
+        n = inst & 0xF #4th digit
+        nn = inst & 0xFF #3rd and 4th digits
+        nnn = inst & 0xFFF #2nd, 3rd and 4th digits
+        match inst >> 12:
+            case 0x0:
+                if inst == 0x00E0:
+                    return self.op_00e0
+                if inst == 0x00EE:
+                    return self.op_00ee
+                return partial(self.op_0nnn, nnn)
+            case 0x1:
+                return partial(self.op_1nnn, nnn)
+            case 0x2:
+                return partial(self.op_2nnn, nnn)
+            case 0x3:
+                return partial(self.op_3xnn, x, nn)
+            case 0x4:
+                return partial(self.op_4xnn, x, nn)
+            case 0x5:
+                if n != 0:
+                    return partial(self.op_5xyn, x, y, n)
+                return partial(self.op_5xy0, x, y)
+            case 0x6:
+                return partial(self.op_6xnn, x, nn)
+            case 0x7:
+                return partial(self.op_7xnn, x, nn)
+            case 0x8:
+                match n:
                     case 0x0:
-                        self.r_v[x] = self.r_v[y]
-                        logging.debug(f"V{x:x} = V{y:x} ({self.r_v[y]})")
+                        return partial(self.op_8xy0, x, y)
                     case 0x1:
-                        self.r_v[x] |= self.r_v[y]
-                        if self.quirks['vf_reset']:
-                            self.r_v[0xF] = 0x0
-                        logging.debug(f"V{x:x} ({self.r_v[x]}) |= V{y:x} ({self.r_v[y]})")
+                        return partial(self.op_8xy1_vf_reset if self.quirks['vf_reset'] else self.op_8xy1, x, y)
                     case 0x2:
-                        self.r_v[x] &= self.r_v[y]
-                        if self.quirks['vf_reset']:
-                            self.r_v[0xF] = 0x0
-                        logging.debug(f"V{x:x} ({self.r_v[x]}) &= V{y:x} ({self.r_v[y]})")
+                        return partial(self.op_8xy2_vf_reset if self.quirks['vf_reset'] else self.op_8xy2, x, y)
                     case 0x3:
-                        self.r_v[x] ^= self.r_v[y]
-                        if self.quirks['vf_reset']:
-                            self.r_v[0xF] = 0x0
-                        logging.debug(f"V{x:x} ({self.r_v[x]}) ^= V{y:x} ({self.r_v[y]})")
+                        return partial(self.op_8xy3_vf_reset if self.quirks['vf_reset'] else self.op_8xy3, x, y)
                     case 0x4:
-                        self.r_v[x] += self.r_v[y]
-                        logging.debug(f"V{x:x} ({self.r_v[x]}) += V{y:x} ({self.r_v[y]})")
-                        self.r_v[0xF] = (
-                            0x01 if self.r_v[x] >= 0b1_0000_0000 else
-                            0x00
-                        )
-                        self.r_v[x] %= 0b1_0000_0000 #Restrict itself to 8 bits
+                        return partial(self.op_8xy4, x, y)
                     case 0x5:
-                        res = self.r_v[x] - self.r_v[y]
-                        logging.debug(f"V{x:x} ({self.r_v[x]}) -= V{y:x} ({self.r_v[y]})")
-                        if res < 0:
-                            self.r_v[x] = res + 2**8
-                            self.r_v[0xF] = 0x00
-                        else:
-                            self.r_v[x] = res
-                            self.r_v[0xF] = 0x01
-                        self.r_v[x] %= 0b1_0000_0000 #Restrict itself to 8 bits
+                        return partial(self.op_8xy5, x, y)
                     case 0x6:
-                        if self.quirks['shifting']:
-                            flag = self.r_v[x] % 0b10
-                            self.r_v[x] = self.r_v[x] >> 1
-                            self.r_v[0xF] = flag
-                            logging.debug(f"V{x:x} = V{x:x} >> 1 ({self.r_v[x]})")
-                        else:
-                            flag = self.r_v[y] % 0b10
-                            self.r_v[x] = self.r_v[y] >> 1
-                            self.r_v[0xF] = flag
-                            logging.debug(f"V{x:x} = V{y:x} >> 1 ({self.r_v[y]})")
+                        #Shifting quirk shifts VX in place instead of VY
+                        return partial(self.op_8xy6, x, x if self.quirks['shifting'] else y)
                     case 0x7:
-                        res = self.r_v[y] - self.r_v[x]
-                        logging.debug(f"V{x:x} = V{y:x} ({self.r_v[y]}) - V{x:x} ({self.r_v[x]})")
-                        if res < 0:
-                            self.r_v[x] = res + 2**8
-                            self.r_v[0xF] = 0x00
-                        else:
-                            self.r_v[x] = res
-                            self.r_v[0xF] = 0x01
-                        self.r_v[x] %= 0b1_0000_0000 #Restrict itself to 8 bits
+                        return partial(self.op_8xy7, x, y)
                     case 0xE:
-                        if self.quirks['shifting']:
-                            flag = self.r_v[x] // 0b1000_0000
-                            self.r_v[x] = self.r_v[x] << 1
-                            self.r_v[x] %= 0b1_0000_0000 #Restrict itself to 8 bits
-                            self.r_v[0xF] = flag
-                            logging.debug(f"V{x:x} = V{x:x} << 1 ({self.r_v[x]})")
-                        else:
-                            flag = self.r_v[y] // 0b1000_0000
-                            self.r_v[x] = self.r_v[y] << 1
-                            self.r_v[x] %= 0b1_0000_0000 #Restrict itself to 8 bits
-                            self.r_v[0xF] = flag
-                            logging.debug(f"V{x:x} = V{y:x} << 1 ({self.r_v[y]})")
+                        return partial(self.op_8xye, x, x if self.quirks['shifting'] else y)
                     case _:
-                        logging.warning(f"Unexpected digit {op:x} at the end of 0x8XY_ op")
-            elif inst >= 0x9000 and inst <= 0x9FFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                y = (inst % 0x100) // 0x10 #3rd digit
-                if self.r_v[x] != self.r_v[y]:
-                    self.skip_next()
-                logging.debug(f"Skip if V{x:x} ({self.r_v[x]}) != V{y:x} ({self.r_v[y]})")
-            elif inst >= 0xA000 and inst <= 0xAFFF:
-                self.r_i = inst % 0x1000
-                logging.debug(f"Set I to {self.r_i:x}")
-            elif inst >= 0xB000 and inst <= 0xBFFF: #TEST
-                if self.quirks['jumping']:
-                    xnn = inst % 0x1000
-                    x = xnn // 0x100 #2nd digit
-                    self.pc = xnn + self.r_v[x]
-                else:
-                    self.pc = (inst % 0x1000) + self.r_v[0]
-                continue
-            elif inst >= 0xC000 and inst <= 0xCFFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                n = inst % 0x100 #3rd and 4th digits
-                self.r_v[x] = randrange(0b1_0000_0000) & n
-            elif inst >= 0xD000 and inst <= 0xDFFF:
-                display_updated = True
-                inst %= 0x1000
-                x = self.r_v[inst // 0x100] #2nd digit
-                inst %= 0x100 
-                y = self.r_v[inst // 0x10] #3rd digit
-                n = inst % 0x10 #4th digit
-                x %= 64
-                y %= 32
-                set_to_unset = False
-                for j, byte in enumerate(self.ram[self.r_i : self.r_i+n]):
-                    res_y = y + j
-                    if self.quirks['clipping']:
-                        if res_y >= 32:
-                            break
-                    else:
-                        res_y %= 32
-                    for i, bit in enumerate(bin(byte).removeprefix('0b').zfill(8)):
-                        res_x = x + i
-                        if self.quirks['clipping']:
-                            if res_x >= 64:
-                                break
-                        else:
-                            res_x %= 64
-                        bit = int(bit)
-                        prev = self.display_data[res_y][res_x]
-                        if prev == 1 and bit == 1:
-                            set_to_unset = True
-                        self.display_data[res_y][res_x] ^= bit
-                self.r_v[0xF] = 0x1 if set_to_unset else 0x0
-            elif inst >= 0xE000 and inst <= 0xEFFF: #TEST
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                op = inst % 0x100 #3rd and 4th digits
-                match op:
+                        return partial(self.op_unexpected, logging.WARNING,
+                            f"Unexpected digit {n:x} at the end of 0x8XY_ op")
+            case 0x9:
+                return partial(self.op_9xy0, x, y)
+            case 0xA:
+                return partial(self.op_annn, nnn)
+            case 0xB:
+                #Jumping quirk reads the offset from VX instead of V0
+                return partial(self.op_bnnn, nnn, x if self.quirks['jumping'] else 0)
+            case 0xC:
+                return partial(self.op_cxnn, x, nn)
+            case 0xD:
+                if self.quirks['display_wait']:
+                    return partial(self.op_dxyn_clip_wait if self.quirks['clipping'] else self.op_dxyn_wrap_wait, x, y, n)
+                return partial(self.op_dxyn_clip if self.quirks['clipping'] else self.op_dxyn_wrap, x, y, n)
+            case 0xE:
+                match nn:
                     case 0x9E:
-                        if self.kb_input.is_pressed(self.r_v[x]):
-                            self.skip_next()
+                        return partial(self.op_ex9e, x)
                     case 0xA1:
-                        if not self.kb_input.is_pressed(self.r_v[x]):
-                            self.skip_next()
+                        return partial(self.op_exa1, x)
                     case _:
-                        logging.error(f"Unexpected digits {op:x} at the end of 0xEX__ op")
-            elif inst >= 0xF000 and inst <= 0xFFFF:
-                inst %= 0x1000
-                x = inst // 0x100 #2nd digit
-                op = inst % 0x100 #3rd and 4th digits
-                match op:
-                    case 0x07: #TEST
-                        self.r_v[x] = self.delay_timer.timer
-                    case 0x0A: #TEST
-                        input_time = time.time()
-                        self.r_v[x] = self.kb_input.last_key.get()
-                        input_time = time.time() - input_time
-                        epoch_input_time += input_time
-                    case 0x15: #TEST
-                        self.delay_timer.timer = self.r_v[x]
-                    case 0x18: #TEST
-                        #TODO: find cross platform way to beep
-                        #and also be able to interrupt the beep
-                        0 == 0
+                        return partial(self.op_unexpected, logging.ERROR,
+                            f"Unexpected digits {nn:x} at the end of 0xEX__ op")
+            case 0xF:
+                match nn:
+                    case 0x07:
+                        return partial(self.op_fx07, x)
+                    case 0x0A:
+                        return partial(self.op_fx0a, x)
+                    case 0x15:
+                        return partial(self.op_fx15, x)
+                    case 0x18:
+                        return partial(self.op_fx18, x)
                     case 0x1E:
-                        self.r_i += self.r_v[x]
-                        logging.debug(f"I ({self.r_i}) += V{x:x} ({self.r_v[x]})")
+                        return partial(self.op_fx1e, x)
                     case 0x29:
-                        self.r_i = (self.r_v[x] % 0x10)*5 #Font data has 5 bytes each and starts at 0x000
+                        return partial(self.op_fx29, x)
                     case 0x33:
-                        v = self.r_v[x] % 1000
-                        self.ram[self.r_i]   = v // 100
-                        self.ram[self.r_i+1] = (v % 100) // 10
-                        self.ram[self.r_i+2] = v % 10
+                        return partial(self.op_fx33, x)
                     case 0x55:
-                        self.ram[self.r_i:self.r_i+x+1] = bytes(self.r_v[0:x+1])
-                        logging.debug(f"RAM[{self.r_i}:{self.r_i+x+1}] = V[0:{x+1:x}] ({bytes(self.r_v[0:x+1])})")
-                        if self.quirks['memory']:
-                            self.r_i += x + 1
-                    case 0x65: #TEST
-                        self.r_v[0:x+1] = [v % 0b1_0000_0000 for v in self.ram[self.r_i:self.r_i+x+1]]
-                        logging.debug(f"V[0:{x+1}] = RAM[{self.r_i}:{self.r_i+x+1}]")
-                        if self.quirks['memory']:
-                            self.r_i += x + 1
+                        return partial(self.op_fx55_memory if self.quirks['memory'] else self.op_fx55, x)
+                    case 0x65:
+                        return partial(self.op_fx65_memory if self.quirks['memory'] else self.op_fx65, x)
                     case _:
-                        logging.error(f"Unexpected digits {op:x} at the end of 0xFX__ op")
-            
-            if not jumping:
-                self.pc += 2
-
-            #Update display if it's a relevant instruction
-            if display_updated:
-                display_time = time.time()
-                self.display_queue.put(self.display_data)
-                self.display_queue.join()
-                display_time = time.time() - display_time
-                epoch_display_time += display_time
-
-            #After {epoch_size} instructions, check how much faster it was executed than
-            #the target frequency, and sleep to make up for it
-            epoch_counter += 1
-            if epoch_counter == self.epoch_size:
-                #Disregard time waiting for display to refresh and for user to press a key
-                disregarded_time = epoch_display_time + epoch_input_time
-                remaining_time = self.epoch_size*1./self.clk_hz - (time.time() - epoch_start - disregarded_time)
-                if remaining_time < 0:
-                    logging.warning(
-                        f"Epoch took {abs(remaining_time)*1000:.2f}ms too long to meet {self.clk_hz}Hz "
-                        f"({self.epoch_size*1000/self.clk_hz:.2f}ms to do {self.epoch_size} cycles):\r\n"
-                        f"Display: {epoch_display_time*1000:.2f}ms; Input: {epoch_input_time*1000:.2f}ms; "
-                        f"Last instruction: {prev_inst:x}"
-                    )
-                time.sleep(max(remaining_time, 0))
-                epoch_counter = 0
-                epoch_start = time.time()
-                epoch_display_time = 0
-                epoch_input_time = 0
+                        return partial(self.op_unexpected, logging.ERROR,
+                            f"Unexpected digits {nn:x} at the end of 0xFX__ op")
+
+    #Instructions
+    #self.pc already points to the next instruction when these run
+
+    def op_unexpected(self, level, message):
+        logging.log(level, message)
+
+    def op_00e0(self):
+        self.init_screen()
+        self.update_display()
+
+    def op_00ee(self):
+        self.pc = self.stack.pop()
+
+    def op_0nnn(self, nnn):
+        self.stack.append(self.pc)
+        self.pc = nnn
+
+    def op_1nnn(self, nnn):
+        #Short backward jumps might close a loop that's just waiting
+        distance = self.pc - 2 - nnn
+        self.pc = nnn
+        if 0 <= distance <= 4 and self.fast_forward:
+            self.check_idle(nnn, distance)
+
+    def op_2nnn(self, nnn):
+        self.stack.append(self.pc)
+        self.pc = nnn
+
+    def op_3xnn(self, x, nn):
+        if self.r_v[x] == nn:
+            self.skip_next()
+
+    def op_4xnn(self, x, nn):
+        if self.r_v[x] != nn:
+            self.skip_next()
+
+    def op_5xyn(self, x, y, n):
+        logging.warning(f"Unexpected digit {n:x} at the end of 0x5XY0 op")
+        self.op_5xy0(x, y)
+
+    def op_5xy0(self, x, y):
+        if self.r_v[x] == self.r_v[y]:
+            self.skip_next()
+
+    def op_6xnn(self, x, nn):
+        self.r_v[x] = nn
+
+    def op_7xnn(self, x, nn):
+        self.r_v[x] = (self.r_v[x] + nn) & 0xFF #Restrict itself to 8 bits
+
+    def op_8xy0(self, x, y):
+        self.r_v[x] = self.r_v[y]
+
+    def op_8xy1(self, x, y):
+        self.r_v[x] |= self.r_v[y]
+
+    def op_8xy1_vf_reset(self, x, y):
+        self.r_v[x] |= self.r_v[y]
+        self.r_v[0xF] = 0x0
+
+    def op_8xy2(self, x, y):
+        self.r_v[x] &= self.r_v[y]
+
+    def op_8xy2_vf_reset(self, x, y):
+        self.r_v[x] &= self.r_v[y]
+        self.r_v[0xF] = 0x0
+
+    def op_8xy3(self, x, y):
+        self.r_v[x] ^= self.r_v[y]
+
+    def op_8xy3_vf_reset(self, x, y):
+        self.r_v[x] ^= self.r_v[y]
+        self.r_v[0xF] = 0x0
+
+    def op_8xy4(self, x, y):
+        res = self.r_v[x] + self.r_v[y]
+        #VF is written last so it wins when X is F
+        self.r_v[x] = res & 0xFF #Restrict itself to 8 bits
+        self.r_v[0xF] = res >> 8
+
+    def op_8xy5(self, x, y):
+        res = self.r_v[x] - self.r_v[y]
+        self.r_v[x] = res & 0xFF
+        self.r_v[0xF] = 0x00 if res < 0 else 0x01
+
+    #Y is X when the shifting quirk is enabled
+    def op_8xy6(self, x, y):
+        flag = self.r_v[y] & 0b1
+        self.r_v[x] = self.r_v[y] >> 1
+        self.r_v[0xF] = flag
+
+    def op_8xy7(self, x, y):
+        res = self.r_v[y] - self.r_v[x]
+        self.r_v[x] = res & 0xFF
+        self.r_v[0xF] = 0x00 if res < 0 else 0x01
+
+    #Y is X when the shifting quirk is enabled
+    def op_8xye(self, x, y):
+        flag = self.r_v[y] >> 7
+        self.r_v[x] = (self.r_v[y] << 1) & 0xFF #Restrict itself to 8 bits
+        self.r_v[0xF] = flag
+
+    def op_9xy0(self, x, y):
+        if self.r_v[x] != self.r_v[y]:
+            self.skip_next()
+
+    def op_annn(self, nnn):
+        self.r_i = nnn
+
+    #X is 0 unless the jumping quirk is enabled
+    def op_bnnn(self, nnn, x):
+        self.pc = nnn + self.r_v[x]
+
+    def op_cxnn(self, x, nn):
+        self.r_v[x] = self.rng.randrange(0b1_0000_0000) & nn
+
+    #Each sprite row is lined up with the screen row with a single shift, XORed in whole,
+    #and a collision is any bit that was already set under it
+    def op_dxyn_clip(self, x, y, n):
+        x = self.r_v[x] % 64
+        y = self.r_v[y] % 32
+        display_data = self.display_data
+        collision = 0
+        for byte in self.ram[self.r_i : self.r_i+min(n, 32-y)]:
+            #Bits that go past the right edge are shifted out
+            bits = byte << (56 - x) if x <= 56 else byte >> (x - 56)
+            collision |= display_data[y] & bits
+            display_data[y] ^= bits
+            y += 1
+        self.r_v[0xF] = 0x1 if collision else 0x0
+        self.update_display()
+
+    def op_dxyn_wrap(self, x, y, n):
+        x = self.r_v[x] % 64
+        y = self.r_v[y] % 32
+        display_data = self.display_data
+        collision = 0
+        for byte in self.ram[self.r_i : self.r_i+n]:
+            #Bits that go past the right edge come back from the left
+            bits = ((byte << 56 | byte << 120) >> x) & 0xFFFF_FFFF_FFFF_FFFF
+            collision |= display_data[y] & bits
+            display_data[y] ^= bits
+            y = (y + 1) % 32
+        self.r_v[0xF] = 0x1 if collision else 0x0
+        self.update_display()
+
+    #With the display_wait quirk, drawing a sprite waits for the next vblank like the original
+    #interpreter did, so there's at most one sprite draw per frame. The wait is on the core's own
+    #frames: the rest of the frame is skipped, and run paces the frames to the wall clock
+    def op_dxyn_clip_wait(self, x, y, n):
+        self.op_dxyn_clip(x, y, n)
+        self.vblank_wait = True
+        self.vblank_waits += 1
+        raise VBlankWait()
+
+    def op_dxyn_wrap_wait(self, x, y, n):
+        self.op_dxyn_wrap(x, y, n)
+        self.vblank_wait = True
+        self.vblank_waits += 1
+        raise VBlankWait()
+
+    def op_ex9e(self, x):
+        if self.kb_input.keys & (1 << self.r_v[x]):
+            self.skip_next()
+
+    def op_exa1(self, x):
+        if not self.kb_input.keys & (1 << self.r_v[x]):
+            self.skip_next()
+
+    def op_fx07(self, x):
+        self.r_v[x] = self.delay_timer.timer
+
+    #Waits for a key to be released, like the original interpreter, without ever blocking:
+    #until then it runs again and idles through the rest of the frame, so the timers keep
+    #going and the frame still ends on time
+    def op_fx0a(self, x):
+        release_count = self.kb_input.release_count
+        if self.key_wait is None:
+            self.key_wait = release_count
+        if release_count == self.key_wait:
+            #No key released yet, run this instruction again
+            self.pc -= 2
+            raise IdleLoop(1, False)
+        self.key_wait = None
+        self.r_v[x] = self.kb_input.last_released
+
+    def op_fx15(self, x):
+        self.delay_timer.timer = self.r_v[x]
+
+    def op_fx18(self, x):
+        self.sound_timer.timer = self.r_v[x]
+
+    def op_fx1e(self, x):
+        self.r_i += self.r_v[x]
+
+    def op_fx29(self, x):
+        self.r_i = (self.r_v[x] % 0x10)*5 #Font data has 5 bytes each and starts at 0x000
+
+    def op_fx33(self, x):
+        v = self.r_v[x] % 1000
+        self.ram[self.r_i]   = v // 100
+        self.ram[self.r_i+1] = (v % 100) // 10
+        self.ram[self.r_i+2] = v % 10
+        if self.blocks is not None:
+            self.blocks.invalidate(self.r_i, self.r_i+3)
+
+    def op_fx55(self, x):
+        self.ram[self.r_i:self.r_i+x+1] = bytes(self.r_v[0:x+1])
+        if self.blocks is not None:
+            self.blocks.invalidate(self.r_i, self.r_i+x+1)
+
+    def op_fx55_memory(self, x):
+        self.op_fx55(x)
+        self.r_i += x + 1
+
+    def op_fx65(self, x):
+        self.r_v[0:x+1] = self.ram[self.r_i:self.r_i+x+1]
+
+    def op_fx65_memory(self, x):
+        self.op_fx65(x)
+        self.r_i += x + 1
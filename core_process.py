@@ -0,0 +1,233 @@
+import logging
+import multiprocessing
+import queue
+import struct
+import threading
+from multiprocessing import shared_memory
+
+from core import Core
+
+#Runs the core in the background, either in a process of its own, so the interpreter doesn't
+#compete with the Tk mainloop and the keyboard hook for the GIL, or in a thread
+#For a process, frames and the keypad go through one shared memory block, without pickling or
+#copying through a pipe. Commands (load, reset, quirk changes) go through a pipe, or a queue for
+#a thread, that the core checks after every frame
+
+#Layout of the shared memory block
+#  sequence: 8 bytes, even once a frame is complete, odd while the core is writing one
+#  rows: 32 rows of 64 bits
+#  keys: 16 bit mask of the pressed keys
+#  last released: the last key released
+#  release count: 32 bits, counts key releases
+sequence_format = struct.Struct('<Q')
+rows_format = struct.Struct('<32Q')
+keys_format = struct.Struct('<H')
+last_released_format = struct.Struct('<B')
+release_count_format = struct.Struct('<I')
+SEQUENCE_OFFSET = 0
+ROWS_OFFSET = SEQUENCE_OFFSET + sequence_format.size
+KEYS_OFFSET = ROWS_OFFSET + rows_format.size
+LAST_RELEASED_OFFSET = KEYS_OFFSET + keys_format.size
+RELEASE_COUNT_OFFSET = LAST_RELEASED_OFFSET + last_released_format.size
+SHARED_SIZE = RELEASE_COUNT_OFFSET + release_count_format.size
+
+#Frames in shared memory, with the same interface as FrameChannel
+#The sequence number works as a seqlock: the renderer knows a frame is new when the number
+#changed, and that it read a whole one when the number is even and the same before and after
+class SharedFrame:
+    buffer = None
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    #Core side
+
+    def publish(self, display_data):
+        sequence, = sequence_format.unpack_from(self.buffer, SEQUENCE_OFFSET)
+        sequence_format.pack_into(self.buffer, SEQUENCE_OFFSET, sequence + 1)
+        rows_format.pack_into(self.buffer, ROWS_OFFSET, *display_data)
+        sequence_format.pack_into(self.buffer, SEQUENCE_OFFSET, sequence + 2)
+
+    #Renderer side
+
+    #Returns (frame number, copy of the frame), or None if nothing new since last_frame
+    def take(self, last_frame=None):
+        while True:
+            sequence, = sequence_format.unpack_from(self.buffer, SEQUENCE_OFFSET)
+            if sequence // 2 == last_frame:
+                return None
+            if sequence % 2:
+                #The core is in the middle of writing it
+                continue
+            rows = list(rows_format.unpack_from(self.buffer, ROWS_OFFSET))
+            if sequence_format.unpack_from(self.buffer, SEQUENCE_OFFSET)[0] == sequence:
+                return sequence // 2, rows
+
+#Keypad in shared memory, written by the frontend and read by the core
+class SharedKeypad:
+    buffer = None
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    #Frontend side, only one process writes
+
+    def press(self, key):
+        keys, = keys_format.unpack_from(self.buffer, KEYS_OFFSET)
+        keys_format.pack_into(self.buffer, KEYS_OFFSET, keys | (1 << key))
+
+    #The key goes in before the count, so the core never sees a new count with an old key
+    def release(self, key):
+        keys, = keys_format.unpack_from(self.buffer, KEYS_OFFSET)
+        keys_format.pack_into(self.buffer, KEYS_OFFSET, keys & ~(1 << key))
+        last_released_format.pack_into(self.buffer, LAST_RELEASED_OFFSET, key)
+        release_count, = release_count_format.unpack_from(self.buffer, RELEASE_COUNT_OFFSET)
+        release_count_format.pack_into(self.buffer, RELEASE_COUNT_OFFSET, (release_count + 1) & 0xFFFFFFFF)
+
+    #Core side, same interface as KB_Input
+
+    @property
+    def keys(self):
+        return keys_format.unpack_from(self.buffer, KEYS_OFFSET)[0]
+
+    @property
+    def release_count(self):
+        return release_count_format.unpack_from(self.buffer, RELEASE_COUNT_OFFSET)[0]
+
+    @property
+    def last_released(self):
+        return last_released_format.unpack_from(self.buffer, LAST_RELEASED_OFFSET)[0]
+
+#Frontend side handle on the core process
+class CoreProcess:
+    shared = None
+    display = None
+    keypad = None
+    control = None
+    process = None
+
+    def __init__(self, display_hz=60):
+        self.shared = shared_memory.SharedMemory(create=True, size=SHARED_SIZE)
+        self.shared.buf[:SHARED_SIZE] = bytes(SHARED_SIZE)
+        self.display = SharedFrame(self.shared.buf)
+        self.keypad = SharedKeypad(self.shared.buf)
+        self.control, control = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=serve, args=(self.shared.name, control, display_hz), daemon=True
+        )
+
+    def start(self):
+        self.process.start()
+
+    #Load a ROM file and start running it from reset
+    def load(self, file_name, quirks:dict, **settings):
+        self.control.send(('load', file_name, dict(quirks), settings))
+
+    def reset(self):
+        self.control.send(('reset',))
+
+    #Carries on from the current state with the new quirks
+    def set_quirks(self, quirks:dict):
+        self.control.send(('quirks', dict(quirks)))
+
+    def close(self, timeout=1):
+        if self.process.is_alive():
+            self.control.send(('quit',))
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.control.close()
+        self.display = None
+        self.keypad = None
+        self.shared.close()
+        self.shared.unlink()
+
+#Runs the core until a command comes in, handles it, and so on until told to quit
+#poll() tells whether a command is waiting, receive() blocks until the next one. Commands are
+#('load', file name, quirks, settings), ('reset',), ('quirks', quirks) and ('quit',)
+#Everything is reused from one ROM to the next, a load only reinitializes the core in place
+#A ROM that crashes stays stopped until the next load or reset, the loop keeps taking commands
+def command_loop(core, poll, receive):
+    #Any command stops the frame loop, so it's handled right away
+    def check_control(core):
+        if poll():
+            core.stop()
+    core.on_frame.append(check_control)
+
+    settings = None
+    reset = False
+    crashed = False
+    try:
+        while True:
+            if settings is not None and not crashed and not poll():
+                try:
+                    core.run(reset=reset)
+                except Exception as e:
+                    #Core.run already logged the last instructions when tracing
+                    logging.exception(f"ROM crashed at {core.pc:#05x}: {e}")
+                    crashed = True
+                reset = False
+            command, *args = receive()
+            if command == 'quit':
+                break
+            elif command == 'load':
+                file_name, quirks, settings = args
+                core.setup(file_name, quirks, **settings)
+                reset = True
+                crashed = False
+            elif command == 'reset' and settings is not None:
+                reset = True
+                crashed = False
+            elif command == 'quirks' and settings is not None:
+                core.configure(args[0], **settings)
+    finally:
+        core.on_frame.remove(check_control)
+
+#Entry point of the core process
+def serve(shared_name, control, display_hz):
+    shared = shared_memory.SharedMemory(name=shared_name)
+    core = Core(
+        display=SharedFrame(shared.buf), kb_input=SharedKeypad(shared.buf), display_hz=display_hz
+    )
+    def receive():
+        try:
+            return control.recv()
+        except EOFError:
+            #The frontend is gone
+            return ('quit',)
+    try:
+        command_loop(core, control.poll, receive)
+    finally:
+        core.display = None
+        core.kb_input = None
+        shared.close()
+
+#Same interface as CoreProcess, for a core in this process
+#One thread runs every ROM loaded into the core, and it ends with close
+class CoreThread:
+    core = None
+    commands = None
+    thread = None
+
+    def __init__(self, core):
+        self.core = core
+        self.commands = queue.Queue()
+        self.thread = threading.Thread(
+            target=command_loop, args=(core, lambda: not self.commands.empty(), self.commands.get), daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def load(self, file_name, quirks:dict, **settings):
+        self.commands.put(('load', file_name, dict(quirks), settings))
+
+    def reset(self):
+        self.commands.put(('reset',))
+
+    def set_quirks(self, quirks:dict):
+        self.commands.put(('quirks', dict(quirks)))
+
+    def close(self, timeout=1):
+        self.commands.put(('quit',))
+        self.thread.join(timeout)
@@ -1,29 +1,41 @@
-from tkinter import (Tk, Canvas, PhotoImage, Menu, filedialog, Toplevel,
+from tkinter import (Tk, Canvas, Menu, filedialog, Toplevel,
     Checkbutton, IntVar, Button)
-import threading
-import queue
-import time
 import os
+from audio import Sound, LiveSink
 from core import Core
+from core_process import CoreProcess, CoreThread
+from frame_channel import FrameChannel
+from kb_input import KB_Input
+from replay import InputRecorder, InputReplay
+from renderers import TkRenderer, display_loop
 
 class Emulator:
     #System
-    core = None
-    core_thread = None
-    display_queue = None
+    core = None #Only set when the core runs in this process
+    runner = None #CoreThread or CoreProcess running the core, reused for every ROM
+    kb_input = None
+    replay = None #Only set when replaying input
+    recorder = None #Only set when recording input
+    sound = None #Only set when playing audio
+    display = None
     running = False
 
     #UI
     tk = None
     file_menu = None
     canvas = None
-    img = None
+    renderer = None
     settings_window = None
     quirk_checkbuttons = None
 
     #Settings
     scale = None
     refresh_rate = None
+    clk_hz = None
+    separate_process = False #Run the core in its own process instead of a thread
+    record_input = None #File to save the input to when quitting
+    replay_input = None #File to play the input back from instead of the keyboard
+    audio = False #Play the sound timer's beep, needs sounddevice
     mode = "CHIP-8"
     quirks = {
         'vf_reset': True,
@@ -35,10 +47,17 @@ class Emulator:
     }
 
     #TODO: support different colors
-    def __init__(self, w=64, h=32, scale:int=1, refresh_rate=60, file=None):
+    def __init__(self, w=64, h=32, scale:int=1, refresh_rate=60, file=None, separate_process=False,
+            record_input=None, replay_input=None, audio=False, clk_hz=720, quirks:dict=None):
         #Initialize display and UI
         self.scale = scale
         self.refresh_rate = refresh_rate
+        self.clk_hz = clk_hz
+        self.quirks = dict(quirks if quirks is not None else self.quirks)
+        self.separate_process = separate_process
+        self.record_input = record_input
+        self.replay_input = replay_input
+        self.audio = audio
         w *= self.scale
         h *= self.scale
         self.tk = Tk()
@@ -49,9 +68,19 @@ class Emulator:
         self.tk.geometry(f"{win_w}x{win_h}")
         self.canvas = Canvas(self.tk, width=w, height=h, highlightthickness=0)
         self.canvas.place(relx=.5, rely=.5, anchor="c")
-        self.img = PhotoImage(width=w, height=h)
-        self.canvas.create_image((w/2, h/2), image=self.img, state="normal")
-        self.display_queue = queue.Queue(1)
+        self.renderer = TkRenderer(self.tk, self.canvas, self.scale)
+        if self.separate_process:
+            self.runner = CoreProcess(display_hz=self.refresh_rate)
+            self.display = self.runner.display
+        else:
+            self.display = FrameChannel()
+            self.core = Core(display=self.display, display_hz=self.refresh_rate)
+            self.runner = CoreThread(self.core)
+            #Audio only works with the core in this process
+            if self.audio:
+                self.sound = Sound(LiveSink(frame_hz=self.refresh_rate), frame_hz=self.refresh_rate)
+                self.core.on_frame.append(self.sound.frame)
+        self.runner.start()
         self.create_ui()
         self.tk.update()
         
@@ -65,6 +94,7 @@ class Emulator:
         menu_bar = Menu(self.tk)
         self.file_menu = Menu(menu_bar, tearoff=False)
         self.file_menu.add_command(label="Open", command=self.select_rom)
+        self.file_menu.add_command(label="Reset", command=self.reset, state="disabled")
         self.file_menu.add_separator()
         self.file_menu.add_command(label="Quit", command=self.quit)
         menu_bar.add_cascade(label="File", menu=self.file_menu)
@@ -95,58 +125,60 @@ class Emulator:
         for checkbutton in self.quirk_checkbuttons:
             key = checkbutton['text']
             self.quirks[key] = checkbutton.getvar()
+        if self.running:
+            self.runner.set_quirks(self.quirks)
     
     def select_rom(self):
         file = filedialog.askopenfilename(title="Select a ROM", filetypes=[("CHIP8 ROMs", "*.ch8")])
-        #TODO: check how to properly kill all these threads so it can support resetting/loading a second ROM
-        #and self.running can actually mean *something*
-        self.file_menu.entryconfig("Open", state="disabled")
-        # if self.running:
-        #     self.core_thread
-        self.start_core(file)
+        if file:
+            self.start_core(file)
+    
+    def reset(self):
+        self.runner.reset()
     
     #System
 
+    #Loads the ROM into the running core, which starts over from reset
     def start_core(self, file):
-        self.core = Core(display_queue=self.display_queue, display_hz=self.refresh_rate)
-        self.core.setup(file, quirks=self.quirks)
-        self.core_thread = threading.Thread(target=self.core.run)
-        self.core_thread.start()
-        self.running = True
-        self.display_loop()
+        if self.kb_input is None:
+            self.start_input()
+        settings = {'clk_hz': self.clk_hz}
+        if self.replay is not None:
+            settings['seed'] = self.replay.seed
+        self.runner.load(file, quirks=self.quirks, **settings)
+        self.file_menu.entryconfig("Reset", state="normal")
+        #The display loop keeps running from the first ROM on
+        if not self.running:
+            self.running = True
+            self.display_loop()
+
+    #The keyboard hook only starts once there's a ROM to play
+    def start_input(self):
+        if self.core is None:
+            self.kb_input = KB_Input(keypad=self.runner.keypad)
+            return
+        #Recording and replaying only work with the core in this process
+        if self.replay_input is not None:
+            self.replay = InputReplay.load(self.replay_input)
+            self.replay.attach(self.core)
+            self.kb_input = self.replay
+        elif self.record_input is not None:
+            self.kb_input = KB_Input()
+            self.recorder = InputRecorder(self.kb_input)
+            self.core.kb_input = self.recorder
+            self.core.on_frame.append(self.recorder.update)
+        else:
+            self.kb_input = KB_Input()
+            self.core.kb_input = self.kb_input
     
     def quit(self):
+        self.runner.close()
+        if self.sound is not None:
+            self.sound.sink.close()
+        if self.recorder is not None:
+            self.recorder.save(self.record_input)
         os._exit(1)
-    
-    def display_loop(self):
-        last_refresh = time.time()
-        loops = 0
-        while self.running:
-            loops += 1
-            if not self.display_queue.empty():
-                display_data = self.display_queue.get()
-                self.display_queue.task_done()
-                
-                str_data = [
-                    ["#FFF" if pixel == 1 else "#000" for pixel in line]
-                    for line in display_data
-                ]
-                if self.scale > 1:
-                    str_data = [
-                        [p for p in line for _ in range(self.scale)]
-                        for line in str_data for _ in range(self.scale)
-                    ]
-                self.img.put(str_data)
-            
-            self.tk.update()
-            
-            if self.quirks['display_wait']:
-                elapsed = time.time() - last_refresh
-                remaining = 1./self.refresh_rate - elapsed
-                if remaining > 0:
-                    time.sleep(remaining)
-                else:
-                    print(f"Uh oh, display took {elapsed*1000:.2f}ms to refresh "
-                        f"(target is {1000*1./self.refresh_rate:.2f}ms for {self.refresh_rate}Hz)")
-                last_refresh = time.time()
 
+    #Render the newest frame the core published at the refresh rate
+    def display_loop(self):
+        display_loop(self.display, self.renderer, self.refresh_rate, lambda: self.running)
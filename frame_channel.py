@@ -0,0 +1,34 @@
+import threading
+
+#Double buffered channel between the core and the renderer that never blocks the core.
+#The core copies each new frame into the back buffer and swaps it to the front, and the
+#renderer only ever takes the newest front buffer, dropping anything drawn in between
+class FrameChannel:
+    front = None
+    back = None
+    frame = 0 #Number of frames published so far
+    lock = None
+
+    def __init__(self, rows=32):
+        self.front = [0]*rows
+        self.back = [0]*rows
+        self.frame = 0
+        self.lock = threading.Lock()
+
+    #Core side
+
+    def publish(self, display_data):
+        #The renderer never reads the back buffer, so only the swap needs the lock
+        self.back[:] = display_data
+        with self.lock:
+            self.front, self.back = self.back, self.front
+            self.frame += 1
+
+    #Renderer side
+
+    #Returns (frame number, copy of the frame), or None if nothing new since last_frame
+    def take(self, last_frame=None):
+        with self.lock:
+            if self.frame == last_frame:
+                return None
+            return self.frame, self.front[:]
@@ -0,0 +1,331 @@
+import argparse
+import os
+import re
+import struct
+import zlib
+from operator import xor
+
+#Frame recording, for looking at what a headless run showed after the fact
+#The recorder sits between the core and its display and sees every frame the core publishes
+#(00E0 and DXYN). It keeps the last one published in each timer tick, which is all a display
+#refreshing at that rate could show, and only when it changed: as the cycle it was published at
+#and the XOR against the previous frame, run length encoded. A sprite only changes a few bytes
+#of the frame, so a record is usually a couple dozen bytes instead of the 256 of the whole frame
+#File layout: magic, version, clock speed, cycles recorded, number of records, then the records
+#A record is the cycles since the previous one and the length of its changes (both as varints),
+#then the changes: runs of up to 128 zeros (a byte of 127 + length) or of up to 128 other bytes
+#(a byte of length - 1, then the bytes), with the zeros after the last change left out
+#Export to an animated GIF or a sequence of PNGs is done here too, with the standard library only
+
+MAGIC = b'C8FR'
+VERSION = 1
+header_format = struct.Struct('<4sBIQI')
+frame_format = struct.Struct('>32Q') #A frame's rows, leftmost pixel in the most significant bit
+RUN = re.compile(rb'\x00{1,128}|[^\x00]{1,128}')
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varint(data, i):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, i
+        shift += 7
+
+#Same interface as the display it wraps, passing every frame on to it
+#Runs on the core's thread, so publishing only copies the frame, and it's encoded once the core
+#moves on to the next tick
+class FrameRecorder:
+    core = None
+    display = None #Display the frames are passed on to
+    data = None #Encoded records
+    records = 0
+    previous = None #Last frame recorded
+    cycles = 0 #Recording time of the last record, in cycles
+    pending = None #Last frame published in the current tick, not recorded yet
+    pending_cycles = None #Recording time it was published at, None when there's no pending frame
+    pending_tick = None
+    core_cycles = 0 #Core's cycle count at the last frame published
+    base_cycles = 0 #Recording time the core's cycle count started from, it starts over on reset
+
+    #Puts itself in place of the core's display
+    def __init__(self, core):
+        self.core = core
+        self.display = core.display
+        core.display = self
+        self.data = bytearray()
+        self.previous = [0]*32
+        self.pending = [0]*32
+
+    def publish(self, display_data):
+        self.display.publish(display_data)
+        core_cycles = self.core.cycles
+        if core_cycles < self.core_cycles:
+            #The core was reset, keep counting from where it was
+            self.base_cycles += self.core_cycles
+        self.core_cycles = core_cycles
+        cycles = self.base_cycles + core_cycles
+        tick = cycles // self.core.cycles_per_frame
+        if tick != self.pending_tick:
+            self.flush()
+            self.pending_tick = tick
+        self.pending[:] = display_data
+        self.pending_cycles = cycles
+
+    #Record the pending frame, if it changed
+    def flush(self):
+        if self.pending_cycles is None:
+            return
+        cycles = self.pending_cycles
+        self.pending_cycles = None
+        if self.pending == self.previous:
+            return
+        changes = frame_format.pack(*map(xor, self.pending, self.previous)).rstrip(b'\x00')
+        self.previous[:] = self.pending
+        encoded = bytearray()
+        for run in RUN.findall(changes):
+            if run[0]:
+                encoded.append(len(run) - 1)
+                encoded += run
+            else:
+                encoded.append(127 + len(run))
+        data = self.data
+        encode_varint(cycles - self.cycles, data)
+        encode_varint(len(encoded), data)
+        data += encoded
+        self.cycles = cycles
+        self.records += 1
+
+    #Recording time now, in cycles
+    def end_cycles(self):
+        core_cycles = self.core.cycles
+        if core_cycles < self.core_cycles:
+            return self.base_cycles + self.core_cycles + core_cycles
+        return self.base_cycles + core_cycles
+
+    def save(self, file_name):
+        self.flush()
+        with open(file_name, 'wb') as file:
+            file.write(header_format.pack(MAGIC, VERSION, self.core.clk_hz, self.end_cycles(), self.records))
+            file.write(self.data)
+
+class FrameRecording:
+    clk_hz = None
+    cycles = None #Length of the recording
+    frames = None #(cycle, frame)
+
+    def __init__(self, clk_hz, cycles, frames):
+        self.clk_hz = clk_hz
+        self.cycles = cycles
+        self.frames = frames
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, 'rb') as file:
+            data = file.read()
+        magic, version, clk_hz, cycles, records = header_format.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f"{file_name} isn't a frame recording")
+        if version != VERSION:
+            raise ValueError(f"Unsupported frame recording version {version}")
+        frames = []
+        frame = [0]*32
+        cycle = 0
+        i = header_format.size
+        for _ in range(records):
+            delta, i = decode_varint(data, i)
+            length, i = decode_varint(data, i)
+            end = i + length
+            changes = bytearray()
+            while i < end:
+                control = data[i]
+                i += 1
+                if control < 128:
+                    changes += data[i:i+control+1]
+                    i += control + 1
+                else:
+                    changes += bytes(control - 127)
+            changes += bytes(frame_format.size - len(changes))
+            frame = list(map(xor, frame, frame_format.unpack(changes)))
+            cycle += delta
+            frames.append((cycle, frame))
+        return cls(clk_hz, cycles, frames)
+
+    #Frame shown at every 1/fps seconds, from the start to the end of the recording
+    def sample(self, fps):
+        frames = self.frames
+        blank = [0]*32
+        position = 0
+        for n in range(int(self.cycles*fps/self.clk_hz) + 1):
+            cycle = n*self.clk_hz/fps
+            while position < len(frames) and frames[position][0] <= cycle:
+                position += 1
+            yield frames[position-1][1] if position else blank
+
+    #(frame, delay in 1/100 seconds), merging frames that would be shown for less than
+    #min_delay, since viewers slow those down instead of showing them
+    def timeline(self, min_delay=2):
+        shown = [] #[frame, start]
+        for cycle, frame in self.frames:
+            start = cycle*100 // self.clk_hz
+            if shown and start - shown[-1][1] < min_delay:
+                #Too soon, it replaces the one before
+                shown[-1][0] = frame
+                if len(shown) > 1 and shown[-2][0] == frame:
+                    shown.pop()
+            elif not shown or shown[-1][0] != frame:
+                shown.append([frame, start])
+        if not shown or shown[0][1] > 0:
+            shown.insert(0, [[0]*32, 0])
+        end = self.cycles*100 // self.clk_hz
+        return [
+            (frame, max((shown[n+1][1] if n + 1 < len(shown) else end) - start, min_delay))
+            for n, (frame, start) in enumerate(shown)
+        ]
+
+#Export
+
+#Pixel rows of a frame blown up to scale in both directions, one byte per pixel (0 or 1)
+class PixelScaler:
+    scale = None
+    row_cache = None
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.row_cache = {}
+
+    def row(self, row):
+        data = self.row_cache.get(row)
+        if data is None:
+            if len(self.row_cache) >= 4096:
+                self.row_cache.clear()
+            data = bytes(pixel for pixel in f"{row:064b}".encode() for _ in range(self.scale)).translate(
+                bytes.maketrans(b'01', b'\x00\x01'))
+            self.row_cache[row] = data
+        return data
+
+    def frame(self, frame):
+        return b''.join(self.row(row)*self.scale for row in frame)
+
+#GIF's variable length LZW, starting at 3 bit codes for a 2 color image
+def lzw(pixels, min_code_size=2):
+    clear = 1 << min_code_size
+    code_size = min_code_size + 1
+    next_code = clear + 2
+    table = {}
+    out = bytearray()
+    bits = 0 #Bits waiting to go out, least significant first
+    bit_count = 0
+
+    def emit(code):
+        nonlocal bits, bit_count
+        bits |= code << bit_count
+        bit_count += code_size
+        while bit_count >= 8:
+            out.append(bits & 0xFF)
+            bits >>= 8
+            bit_count -= 8
+
+    emit(clear)
+    prefix = pixels[0]
+    for pixel in pixels[1:]:
+        key = (prefix << 8) | pixel
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > 1 << code_size:
+                code_size += 1
+        else:
+            #Table's full, start over
+            emit(clear)
+            table.clear()
+            code_size = min_code_size + 1
+            next_code = clear + 2
+        prefix = pixel
+    emit(prefix)
+    #The decoder adds an entry for the last code too, which can make the end code a bit longer
+    if next_code == 1 << code_size and code_size < 12:
+        code_size += 1
+    emit(clear + 1)
+    if bit_count:
+        out.append(bits & 0xFF)
+    return out
+
+def sub_blocks(data):
+    return b''.join(bytes((len(data[i:i+255]),)) + data[i:i+255] for i in range(0, len(data), 255)) + b'\x00'
+
+#Animated GIF, black and white, looping forever
+def write_gif(recording, file_name, scale=1):
+    w = 64*scale
+    h = 32*scale
+    scaler = PixelScaler(scale)
+    with open(file_name, 'wb') as file:
+        #Header, screen with a 2 color global palette, and the looping extension
+        file.write(b'GIF89a' + struct.pack('<HHBBB', w, h, 0x80, 0, 0) + b'\x00\x00\x00\xff\xff\xff')
+        file.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+        for frame, delay in recording.timeline():
+            file.write(b'\x21\xf9\x04\x00' + struct.pack('<H', delay) + b'\x00\x00')
+            file.write(b'\x2c' + struct.pack('<HHHHB', 0, 0, w, h, 0))
+            file.write(b'\x02' + sub_blocks(lzw(scaler.frame(frame))))
+        file.write(b'\x3b')
+
+def png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+#1 bit grayscale PNG
+def png(frame, scale=1):
+    row_cache = {}
+    raw = bytearray()
+    for row in frame:
+        line = row_cache.get(row)
+        if line is None:
+            bits = "".join(pixel*scale for pixel in f"{row:064b}")
+            line = row_cache[row] = b'\x00' + int(bits, 2).to_bytes(8*scale, 'big')
+        raw += line*scale
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + png_chunk(b'IHDR', struct.pack('>IIBBBBB', 64*scale, 32*scale, 1, 0, 0, 0, 0))
+        + png_chunk(b'IDAT', zlib.compress(bytes(raw)))
+        + png_chunk(b'IEND', b'')
+    )
+
+#One PNG per 1/fps seconds, named so that e.g. ffmpeg -framerate 60 -i frame_%06d.png can read them
+def write_pngs(recording, directory, scale=1, fps=60):
+    os.makedirs(directory, exist_ok=True)
+    previous = None
+    for n, frame in enumerate(recording.sample(fps)):
+        if frame is not previous:
+            image = png(frame, scale)
+            previous = frame
+        with open(os.path.join(directory, f"frame_{n:06}.png"), 'wb') as file:
+            file.write(image)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a frame recording to an animated GIF or PNGs")
+    parser.add_argument('recording')
+    parser.add_argument('output', help="GIF file, or a directory for PNGs with --png")
+    parser.add_argument('--png', action='store_true', help="Write a sequence of PNGs instead of a GIF")
+    parser.add_argument('--scale', type=int, default=4)
+    parser.add_argument('--fps', type=int, default=60, help="Frames per second of the PNG sequence")
+    args = parser.parse_args()
+    recording = FrameRecording.load(args.recording)
+    if args.png:
+        write_pngs(recording, args.output, args.scale, args.fps)
+    else:
+        write_gif(recording, args.output, args.scale)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+#Null implementations of the systems the core talks to, so it can run without a window
+#or a keyboard hook (e.g. in CI, batch jobs and benchmarks)
+
+class NullDisplay:
+    def publish(self, display_data):
+        pass
+
+#No key is ever pressed, so FX0A just keeps waiting
+class NullInput:
+    keys = 0
+    release_count = 0
+    last_released = None
@@ -1,14 +1,21 @@
 from pynput import keyboard
 import threading
-import queue
 
+#Keyboard state from a global key listener thread
+#The listener is the only writer: it keeps a bitmask of the keys held down (bit n for key n) and
+#counts releases, so the core can read both at any time without locking
 class KB_Input:
     key_map = None
-    last_key = None
+    key_lookup = None #Host key -> CHIP-8 key, the reverse of key_map
+    keys = 0 #Bitmask of the keys held down
+    release_count = 0 #Key releases so far, FX0A waits for it to change
+    last_released = None
     thread = None
+    keypad = None #Optional shared keypad (e.g. SharedKeypad) kept in sync with the keys held down
 
     #TODO: configurable keymap
-    def __init__(self, key_map = None):
+    def __init__(self, key_map = None, keypad = None):
+        self.keypad = keypad
         if key_map is None:
             self.key_map = {
                 #TODO work with numpad, or test on desktop
@@ -29,36 +36,31 @@ class KB_Input:
                 0xE: keyboard.KeyCode(char="e"),
                 0xF: keyboard.KeyCode(char="f"),
             }
-        self.last_key = queue.Queue(1)
-        thread = threading.Thread(target=self.detect_key_press)
-        thread.start()
-    
-    def is_pressed(self, key):
-        if self.last_key.full():
-            res = key == self.last_key.queue[0]
-            return res
-        return False
+        else:
+            self.key_map = key_map
+        self.key_lookup = {keycode: hexa for hexa, keycode in self.key_map.items()}
+        self.keys = 0
+        self.release_count = 0
+        self.thread = threading.Thread(target=self.detect_key_press)
+        self.thread.start()
     
     def on_press(self, key):
-        for hexa, keycode in self.key_map.items():
-            if key == keycode:
-                if self.last_key.full():
-                    self.last_key.get_nowait()
-                    self.last_key.task_done()
-                self.last_key.put(hexa)
-                return True
+        hexa = self.key_lookup.get(key)
+        if hexa is not None:
+            self.keys |= 1 << hexa
+            if self.keypad is not None:
+                self.keypad.press(hexa)
     
     def on_release(self, key):
-        if self.last_key.full():
-            for hexa, keycode in self.key_map.items():
-                if key == keycode:
-                    if hexa == self.last_key.queue[0]:
-                        self.last_key.get_nowait()
-                        self.last_key.task_done()
-                    return True 
+        hexa = self.key_lookup.get(key)
+        if hexa is not None:
+            self.keys &= ~(1 << hexa)
+            self.last_released = hexa
+            self.release_count += 1
+            if self.keypad is not None:
+                self.keypad.release(hexa)
 
     def detect_key_press(self):
         while True:
             with keyboard.Listener(on_press=self.on_press, on_release=self.on_release) as listener:
                 listener.join()
-        
\ No newline at end of file
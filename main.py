@@ -1,7 +1,152 @@
-from emulator import Emulator
+import argparse
+
+from core import Core
+from rom_runner import QUIRK_SETS, state_hash
+
+#The GUI and everything else that isn't needed for every run is imported only once it's needed:
+#Tk and pynput take longer to import than a short headless run takes to finish, and they aren't
+#always installed
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CHIP-8 emulator")
+    parser.add_argument('rom', nargs='?', help="ROM to run (the GUI can also open one from its menu)")
+    parser.add_argument('--quirks', default='chip8', choices=QUIRK_SETS)
+    parser.add_argument('--clk-hz', type=int, default=720, help="Instructions per second")
+    parser.add_argument('--refresh-rate', type=int, default=60, help="Frames per second, also the timer rate")
+    parser.add_argument('--scale', type=int, default=4, help="Pixel size in the GUI")
+    parser.add_argument('--separate-process', action='store_true', help="Run the core in its own process (GUI, without --audio, --record or --replay)")
+    parser.add_argument('--audio', action='store_true', help="Play the beep, needs sounddevice (GUI and terminal)")
+    parser.add_argument('--record', metavar='FILE', help="Save the input to FILE when quitting (GUI)")
+    parser.add_argument('--replay', metavar='FILE', help="Play the input back from FILE")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--terminal', action='store_true',
+        help="Draw in the terminal instead of a window, with input only from --replay")
+    mode.add_argument('--headless', action='store_true', help="Run without a window, as fast as possible")
+    headless = parser.add_argument_group("headless runs")
+    headless.add_argument('--seed', type=int, help="Seed for CXNN's random numbers")
+    headless.add_argument('--translate', action='store_true', help="Run with block translation")
+    limit = headless.add_mutually_exclusive_group()
+    limit.add_argument('--cycles', type=int, help="Stop after this many instructions")
+    limit.add_argument('--frames', type=int, help="Stop after this many frames")
+    headless.add_argument('--hash', action='store_true', help="Print a hash of the final display and registers")
+    headless.add_argument('--wav', metavar='FILE', help="Write the audio to a WAV file")
+    headless.add_argument('--record-frames', metavar='FILE', help="Write the frames shown to FILE")
+    args = parser.parse_args()
+
+    if args.headless:
+        if args.rom is None:
+            parser.error("headless runs need a ROM")
+        if args.cycles is None and args.frames is None:
+            parser.error("headless runs need --cycles or --frames")
+        for option in ('separate_process', 'audio', 'record'):
+            if getattr(args, option) not in (None, False):
+                parser.error(f"--{option.replace('_', '-')} only works with the GUI")
+    else:
+        if args.terminal:
+            if args.rom is None:
+                parser.error("--terminal needs a ROM")
+            for option in ('separate_process', 'record'):
+                if getattr(args, option) not in (None, False):
+                    parser.error(f"--{option.replace('_', '-')} only works with the GUI")
+        elif args.separate_process:
+            #Recording, replaying and audio only hook into a core running in this process
+            for option in ('audio', 'record', 'replay'):
+                if getattr(args, option) not in (None, False):
+                    parser.error(f"--{option} doesn't work with --separate-process")
+        for option in ('seed', 'translate', 'cycles', 'frames', 'hash', 'wav', 'record_frames'):
+            if getattr(args, option) not in (None, False):
+                parser.error(f"--{option.replace('_', '-')} only works with --headless")
+    return args
+
+def run_headless(args):
+    core = Core(display_hz=args.refresh_rate)
+    with open(args.rom, 'rb') as file:
+        core.load(file.read())
+    core.configure(QUIRK_SETS[args.quirks], clk_hz=args.clk_hz, throttle=False, translate=args.translate,
+        seed=args.seed)
+    if args.replay is not None:
+        from replay import InputReplay
+        InputReplay.load(args.replay).attach(core)
+    sink = None
+    if args.wav is not None:
+        from audio import Sound, WavSink
+        sink = WavSink(args.wav)
+        core.on_frame.append(Sound(sink, frame_hz=args.refresh_rate).frame)
+    recorder = None
+    if args.record_frames is not None:
+        from frame_recorder import FrameRecorder
+        recorder = FrameRecorder(core)
+    core.reset()
+
+    cycles = args.cycles if args.cycles is not None else args.frames*core.cycles_per_frame
+    try:
+        if not core.on_frame:
+            core.run_cycles(cycles)
+        else:
+            #Input and audio are handled between frames
+            while core.cycles < cycles:
+                core.run_cycles(min(core.cycles_per_frame, cycles - core.cycles))
+                for callback in core.on_frame:
+                    callback(core)
+    finally:
+        if sink is not None:
+            sink.close()
+        if recorder is not None:
+            recorder.save(args.record_frames)
+    if args.hash:
+        print(state_hash(core))
+
+#Draws in the terminal while the core runs on its own thread, until interrupted with Ctrl+C
+def run_terminal(args):
+    from core_process import CoreThread
+    from frame_channel import FrameChannel
+    from renderers import TerminalRenderer, display_loop
+
+    channel = FrameChannel()
+    core = Core(display=channel, display_hz=args.refresh_rate)
+    settings = {'clk_hz': args.clk_hz}
+    if args.replay is not None:
+        from replay import InputReplay
+        replay = InputReplay.load(args.replay)
+        replay.attach(core)
+        settings['seed'] = replay.seed
+    sound = None
+    if args.audio:
+        from audio import Sound, LiveSink
+        sound = Sound(LiveSink(frame_hz=args.refresh_rate), frame_hz=args.refresh_rate)
+        core.on_frame.append(sound.frame)
+    runner = CoreThread(core)
+    runner.start()
+    runner.load(args.rom, QUIRK_SETS[args.quirks], **settings)
+
+    renderer = TerminalRenderer()
+    try:
+        display_loop(channel, renderer, args.refresh_rate)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.close()
+        renderer.close()
+        if sound is not None:
+            sound.sink.close()
+
+def run_gui(args):
+    from emulator import Emulator
+
+    Emulator(
+        scale=args.scale, refresh_rate=args.refresh_rate, file=args.rom, separate_process=args.separate_process,
+        record_input=args.record, replay_input=args.replay, audio=args.audio, clk_hz=args.clk_hz,
+        quirks=QUIRK_SETS[args.quirks]
+    )
+
+def main():
+    args = parse_args()
+    if args.headless:
+        run_headless(args)
+    elif args.terminal:
+        run_terminal(args)
+    else:
+        run_gui(args)
 
 if __name__ == '__main__':
-    #TODO: parse arguments to get file name and options
-    refresh_rate = 60
-    scale = 4
-    emulator = Emulator(refresh_rate=refresh_rate, scale=scale)
\ No newline at end of file
+    main()
@@ -0,0 +1,132 @@
+import json
+import time
+from collections import Counter
+
+#Profiling counters for a core, kept over a whole run
+#Counts every executed instruction per PC and per opcode, samples the call stack every
+#sample_every instructions for flamegraphs, and adds up the time the core spent waiting
+#instead of running instructions
+class Profiler:
+    core = None
+    sample_every = None
+
+    pc_counts = None #Executions per RAM address
+    inst_counts = None #Executions per opcode
+    idle_counts = None #Executions per RAM address skipped by fast-forwarding idle loops
+    stacks = None #(call sites..., pc) -> samples
+    countdown = None
+
+    #Seconds
+    start = None
+    #Pacing sleep of frames cut short by a display_wait sprite draw. That's the ROM holding itself
+    #to one sprite per frame, the renderer never holds the core up
+    vblank_time = 0
+    input_time = 0 #Waiting for FX0A
+    sleep_time = 0 #Pacing to meet clk_hz
+
+    def __init__(self, core, sample_every=16):
+        self.core = core
+        self.sample_every = sample_every
+        self.reset()
+
+    def reset(self):
+        self.pc_counts = [0]*4096
+        self.inst_counts = [0]*0x10000
+        self.idle_counts = Counter()
+        self.stacks = Counter()
+        self.countdown = self.sample_every
+        self.start = time.perf_counter()
+        self.vblank_time = 0
+        self.input_time = 0
+        self.sleep_time = 0
+
+    #Called by the core before every instruction
+    def record(self, pc, inst, r_i, r_v):
+        self.pc_counts[pc] += 1
+        self.inst_counts[inst] += 1
+        self.countdown -= 1
+        if self.countdown == 0:
+            self.countdown = self.sample_every
+            #Return addresses point right after each call
+            self.stacks[(*(ret - 2 for ret in self.core.stack), pc)] += 1
+
+    #Called by the core when it skips iterations of an idle loop starting at start
+    def record_idle(self, start, length, iterations):
+        for pc in range(start, start + 2*length, 2):
+            self.idle_counts[pc] += iterations
+
+    def add_epoch(self, vblank_time, input_time, sleep_time):
+        self.vblank_time += vblank_time
+        self.input_time += input_time
+        self.sleep_time += sleep_time
+
+    #Export
+
+    #Opcode families, e.g. 8XY4 or FX_
+    @staticmethod
+    def family(inst):
+        match inst >> 12:
+            case 0x0:
+                return {0x00E0: "00E0", 0x00EE: "00EE"}.get(inst, "0NNN")
+            case 0x5 | 0x9:
+                return f"{inst >> 12:X}XY0"
+            case 0x8:
+                return f"8XY{inst & 0xF:X}"
+            case 0xD:
+                return "DXYN"
+            case 0xE | 0xF:
+                return f"{inst >> 12:X}X{inst & 0xFF:02X}"
+            case high if high in (0x1, 0x2, 0xA, 0xB):
+                return f"{high:X}NNN"
+            case high:
+                return f"{high:X}XNN"
+
+    def report(self, top=20):
+        core = self.core
+        elapsed = time.perf_counter() - self.start
+        vblank_time = self.vblank_time
+        families = Counter()
+        for inst, count in enumerate(self.inst_counts):
+            if count:
+                families[self.family(inst)] += count
+        hot_spots = sorted(
+            ((pc, count) for pc, count in enumerate(self.pc_counts) if count),
+            key=lambda item: item[1], reverse=True
+        )[:top]
+        return {
+            'cycles': core.cycles,
+            'idle_cycles': core.idle_cycles,
+            'target_hz': core.clk_hz,
+            'achieved_hz': core.cycles / elapsed if elapsed > 0 else 0,
+            'time': {
+                'elapsed': elapsed,
+                'vblank_wait': vblank_time,
+                'input_wait': self.input_time,
+                'pacing_sleep': self.sleep_time,
+                'running': elapsed - vblank_time - self.input_time - self.sleep_time,
+            },
+            'frames': core.scheduler.stats() if core.scheduler is not None else None,
+            'families': dict(families.most_common()),
+            'hot_spots': [
+                {'pc': f"{pc:#05x}", 'count': count, 'inst': f"{(core.ram[pc] << 8) | core.ram[(pc + 1) & 0xFFF]:04X}"}
+                for pc, count in hot_spots
+            ],
+            'pc_counts': {f"{pc:#05x}": count for pc, count in enumerate(self.pc_counts) if count},
+            'idle_counts': {f"{pc:#05x}": count for pc, count in sorted(self.idle_counts.items())},
+        }
+
+    def write_json(self, file_name, top=20):
+        with open(file_name, 'w') as file:
+            json.dump(self.report(top), file, indent=2)
+
+    #One line per sampled call stack, as "caller;callee;pc count", ready for flamegraph.pl
+    #or speedscope. Frames are ROM addresses: the call sites, then the sampled instruction
+    def collapsed(self):
+        return [
+            ";".join(f"{pc:#05x}" for pc in stack) + f" {count*self.sample_every}"
+            for stack, count in self.stacks.most_common()
+        ]
+
+    def write_collapsed(self, file_name):
+        with open(file_name, 'w') as file:
+            file.write("\n".join(self.collapsed()) + "\n")
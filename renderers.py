@@ -0,0 +1,152 @@
+import sys
+import time
+
+#Renderers put the core's frames (32 rows of 64 bit ints, leftmost pixel in the most significant
+#bit) in front of the user. They all have the same interface:
+#  present(display_data): show a frame
+#  update(): let the presentation layer handle its own events, once per refresh
+#  close()
+
+class NullRenderer:
+    def present(self, display_data):
+        pass
+
+    def update(self):
+        pass
+
+    def close(self):
+        pass
+
+#Draws on a Tk canvas through a PhotoImage, scaled up by an integer factor
+#Rows are put unscaled into a 64x32 image, and Tk zooms the changed ones into the one shown,
+#so the image data built here doesn't grow with the scale
+#Tk is only imported when it's used, it isn't always there on headless machines
+class TkRenderer:
+    tk = None
+    source = None #Frame at 1 pixel per pixel
+    img = None #Frame as shown, zoomed up from source
+    scale = None
+    presented = None #Rows currently shown in img
+    row_cache = None #Tk image data for each row bit pattern seen so far
+
+    def __init__(self, tk, canvas, scale=1):
+        from tkinter import PhotoImage
+        self.tk = tk
+        self.scale = scale
+        w = 64*scale
+        h = 32*scale
+        self.source = PhotoImage(master=tk, width=64, height=32)
+        self.img = PhotoImage(master=tk, width=w, height=h)
+        self.presented = [None]*32 #Nothing drawn yet, so every row is dirty
+        self.row_cache = {}
+        canvas.create_image((w/2, h/2), image=self.img, state="normal")
+
+    #Only put the rows that changed since the last presented frame, each run of consecutive
+    #changed rows in a single put and a single zoomed copy
+    def present(self, display_data):
+        start = None
+        for y in range(len(display_data) + 1):
+            dirty = y < len(display_data) and display_data[y] != self.presented[y]
+            if dirty and start is None:
+                start = y
+            elif not dirty and start is not None:
+                data = " ".join(self.row_data(row) for row in display_data[start:y])
+                self.source.put(data, to=(0, start))
+                self.img.tk.call(
+                    self.img, 'copy', self.source, '-from', 0, start, 64, y,
+                    '-to', 0, start*self.scale, '-zoom', self.scale
+                )
+                start = None
+        self.presented[:] = display_data
+
+    #Tk image data for a row
+    def row_data(self, row):
+        data = self.row_cache.get(row)
+        if data is None:
+            if len(self.row_cache) >= 4096:
+                self.row_cache.clear()
+            data = "{" + " ".join("#FFF" if pixel == '1' else "#000" for pixel in f"{row:064b}") + "}"
+            self.row_cache[row] = data
+        return data
+
+    def update(self):
+        self.tk.update()
+
+    def close(self):
+        pass
+
+#Draws in a terminal with ANSI escape sequences, two pixel rows per line of text using Unicode
+#half blocks, so the whole screen takes 64x16 characters
+#Only the characters that changed since the last frame are written, each run of them behind
+#one cursor move, and a whole frame goes out in a single write
+class TerminalRenderer:
+    #Top pixel, bottom pixel -> character
+    CELLS = (" ", "▄", "▀", "█")
+
+    file = None
+    presented = None #Rows currently shown in the terminal
+    cells = None #Characters currently shown, per line of text
+
+    def __init__(self, file=None):
+        self.file = file if file is not None else sys.stdout
+        self.presented = [None]*32
+        self.cells = [[None]*64 for _ in range(16)]
+        #Clear the screen and hide the cursor
+        self.file.write("\x1b[2J\x1b[?25l")
+        self.file.flush()
+
+    def present(self, display_data):
+        cells = self.CELLS
+        out = []
+        for line in range(16):
+            top = display_data[2*line]
+            bottom = display_data[2*line + 1]
+            if top == self.presented[2*line] and bottom == self.presented[2*line + 1]:
+                continue
+            shown = self.cells[line]
+            moved = False
+            for x in range(64):
+                shift = 63 - x
+                cell = cells[(((top >> shift) & 1) << 1) | ((bottom >> shift) & 1)]
+                if cell == shown[x]:
+                    moved = False
+                    continue
+                if not moved:
+                    out.append(f"\x1b[{line + 1};{x + 1}H")
+                    moved = True
+                out.append(cell)
+                shown[x] = cell
+        self.presented[:] = display_data
+        if out:
+            self.file.write("".join(out))
+            self.file.flush()
+
+    def update(self):
+        pass
+
+    #Put the cursor back, below the screen
+    def close(self):
+        self.file.write("\x1b[17;1H\x1b[?25h")
+        self.file.flush()
+
+#Present the newest frame published on display (e.g. a FrameChannel) at the refresh rate,
+#skipping any frame drawn in between
+def display_loop(display, renderer, refresh_rate, running=lambda: True):
+    last_refresh = time.time()
+    last_frame = None
+    while running():
+        new_frame = display.take(last_frame)
+        if new_frame is not None:
+            last_frame, display_data = new_frame
+            renderer.present(display_data)
+
+        renderer.update()
+
+        elapsed = time.time() - last_refresh
+        remaining = 1./refresh_rate - elapsed
+        if remaining > 0:
+            time.sleep(remaining)
+        else:
+            print(f"Uh oh, display took {elapsed*1000:.2f}ms to refresh "
+                f"(target is {1000*1./refresh_rate:.2f}ms for {refresh_rate}Hz)", file=sys.stderr)
+        last_refresh = time.time()
@@ -0,0 +1,128 @@
+import struct
+
+#Input recording and replay, for runs that execute the exact same instructions every time
+#The recorder sits between the core and the real input and only lets the core see input
+#changes at the end of a frame. Each change is logged with the cycle count it happened at, so
+#a replay can hand the core the same keys at the same instructions. Together with the seed for
+#CXNN, that repeats a whole session bit for bit, at any speed and with either engine
+#File layout: magic, version, RNG seed, cycles recorded, then one record per change
+
+MAGIC = b'C8IN'
+VERSION = 1
+header_format = struct.Struct('<4sBQQ')
+#Cycle, keys held, releases since the previous record (at most 255), last key released (0xFF for none)
+event_format = struct.Struct('<QHBB')
+
+#Same interface as KB_Input, reading from another input once per frame
+class InputRecorder:
+    source = None
+    keys = 0
+    release_count = 0
+    last_released = None
+
+    seed = None #RNG seed of the recorded run
+    cycles = 0 #Cycle count at the last update
+    events = None #(cycle, keys, releases, last released)
+    source_release_count = None #Source's count at the last update, its releases before recording don't count
+
+    def __init__(self, source):
+        self.source = source
+        self.events = []
+
+    #Call after every frame (it can go in Core.on_frame)
+    def update(self, core):
+        if core.cycles < self.cycles or core.rng_seed != self.seed:
+            #The core was reset, start over
+            self.events.clear()
+            self.keys = 0
+            self.release_count = 0
+            self.last_released = None
+        self.seed = core.rng_seed
+        self.cycles = core.cycles
+
+        source = self.source
+        keys = source.keys
+        source_release_count = source.release_count
+        releases = 0
+        if self.source_release_count is not None:
+            releases = min(source_release_count - self.source_release_count, 0xFF)
+        self.source_release_count = source_release_count
+        if keys != self.keys or releases:
+            self.keys = keys
+            self.release_count += releases
+            self.last_released = source.last_released
+            self.events.append((core.cycles, keys, releases, self.last_released))
+
+    def save(self, file_name):
+        with open(file_name, 'wb') as file:
+            file.write(header_format.pack(MAGIC, VERSION, self.seed or 0, self.cycles))
+            for cycle, keys, releases, last_released in self.events:
+                file.write(event_format.pack(cycle, keys, releases, 0xFF if last_released is None else last_released))
+
+#Same interface as KB_Input, playing back a recording
+class InputReplay:
+    keys = 0
+    release_count = 0
+    last_released = None
+
+    seed = None
+    cycles = None #Cycle count the recording ends at
+    events = None
+    position = 0 #Next event
+    updated_cycles = 0 #Cycle count at the last update
+
+    def __init__(self, seed, cycles, events):
+        self.seed = seed
+        self.cycles = cycles
+        self.events = events
+        self.rewind()
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, 'rb') as file:
+            data = file.read()
+        magic, version, seed, cycles = header_format.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not an input recording")
+        if version != VERSION:
+            raise ValueError(f"Unsupported input recording version {version}, expected {VERSION}")
+        events = [
+            (cycle, keys, releases, None if last_released == 0xFF else last_released)
+            for cycle, keys, releases, last_released in event_format.iter_unpack(data[header_format.size:])
+        ]
+        return cls(seed, cycles, events)
+
+    def rewind(self):
+        self.keys = 0
+        self.release_count = 0
+        self.last_released = None
+        self.position = 0
+        self.updated_cycles = 0
+
+    #Call after every frame, like InputRecorder.update
+    def update(self, core):
+        if core.cycles < self.updated_cycles:
+            #The core was reset, play from the start
+            self.rewind()
+        self.updated_cycles = core.cycles
+        events = self.events
+        while self.position < len(events) and events[self.position][0] <= core.cycles:
+            _, self.keys, releases, self.last_released = events[self.position]
+            self.release_count += releases
+            self.position += 1
+
+    #Make the core start the recorded run on its next reset, and run it with Core.run
+    def attach(self, core):
+        core.seed = self.seed
+        core.kb_input = self
+        core.on_frame.append(self.update)
+
+    #Replay the whole recording headless, as fast as possible
+    def play(self, core):
+        core.seed = self.seed
+        core.kb_input = self
+        core.reset()
+        self.rewind()
+        while core.cycles < self.cycles:
+            core.run_frames(1)
+            self.update(core)
@@ -0,0 +1,121 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+from core import Core
+
+#Runs a corpus of ROMs headless across a process pool and checks every final state against a
+#golden manifest, so a build can be validated in seconds instead of by hand through Tk
+#Manifest format (JSON, ROM paths relative to the manifest):
+#  {"jobs": [{"rom": "roms/ibm.ch8", "quirks": "chip8", "cycles": 100000, "hash": "..."}, ...]}
+#A job without a hash is new and gets the current build's hash; --update overwrites every hash
+
+QUIRK_SETS = {
+    'chip8': dict(Core.quirks),
+    'schip': dict(Core.quirks, vf_reset=False, memory=False, display_wait=False, shifting=True, jumping=True),
+}
+
+#Everything a ROM can leave behind that a test looks at: the display and the registers
+def state_hash(core):
+    digest = hashlib.sha256()
+    digest.update(b''.join(row.to_bytes(8, 'big') for row in core.display_data))
+    digest.update(bytes(core.r_v))
+    digest.update(f"{core.pc} {core.r_i} {core.stack} {core.delay_timer.timer} {core.sound_timer.timer}".encode())
+    return digest.hexdigest()
+
+#Runs in a worker process. Crashing is a result like any other: the error goes in the hash
+def run_job(rom_path, quirks, cycles, translate=False):
+    core = Core()
+    with open(rom_path, 'rb') as file:
+        core.load(file.read())
+    core.configure(QUIRK_SETS[quirks], throttle=False, translate=translate, seed=0)
+    core.reset()
+    error = None
+    start = time.perf_counter()
+    try:
+        core.run_cycles(cycles)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - start
+    digest = state_hash(core)
+    if error is not None:
+        digest = hashlib.sha256(f"{digest} {error}".encode()).hexdigest()
+    return {
+        'hash': digest,
+        'error': error,
+        'cycles': core.cycles,
+        'cps': core.cycles / elapsed if elapsed > 0 else 0,
+    }
+
+def load_manifest(file_name):
+    if not os.path.exists(file_name):
+        return {'jobs': []}
+    with open(file_name) as file:
+        return json.load(file)
+
+def save_manifest(manifest, file_name):
+    with open(file_name, 'w') as file:
+        json.dump(manifest, file, indent=2)
+        file.write("\n")
+
+#Returns the number of jobs that didn't match the manifest
+def run_manifest(manifest, base_dir, workers=None, translate=False, update=False):
+    #Only imported here, it's slow to import and the rest of the module is used by quick runs
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = manifest['jobs']
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(run_job, os.path.join(base_dir, job['rom']), job['quirks'], job['cycles'], translate)
+            for job in jobs
+        ]
+        for job, future in zip(jobs, futures):
+            result = future.result()
+            expected = job.get('hash')
+            if expected is None:
+                status = "NEW"
+            elif expected == result['hash']:
+                status = "PASS"
+            else:
+                status = "FAIL"
+                failures += 1
+            if update or expected is None:
+                job['hash'] = result['hash']
+            line = f"{status:4} {job['rom']:40} {job['quirks']:6} {result['cycles']:>10} cycles {result['cps']:>12,.0f} cps"
+            if result['error'] is not None:
+                line += f" ({result['error']})"
+            print(line)
+    print(f"{len(jobs) - failures}/{len(jobs)} matched in {time.perf_counter() - start:.2f}s")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ROMs headless and check their final state against a manifest")
+    parser.add_argument('manifest')
+    parser.add_argument('--add', nargs='+', metavar='ROM', help="Add jobs for these ROMs to the manifest")
+    parser.add_argument('--quirks', nargs='+', default=['chip8'], help=f"Quirk sets for added jobs, any of {', '.join(QUIRK_SETS)}")
+    parser.add_argument('--cycles', type=int, default=100_000, help="Cycle budget for added jobs")
+    parser.add_argument('--update', action='store_true', help="Write the current hashes to the manifest")
+    parser.add_argument('--translate', action='store_true', help="Run with block translation")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per CPU)")
+    args = parser.parse_args()
+    for quirks in args.quirks:
+        if quirks not in QUIRK_SETS:
+            parser.error(f"unknown quirk set {quirks}")
+
+    manifest = load_manifest(args.manifest)
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    for rom in args.add or []:
+        rom = os.path.relpath(os.path.abspath(rom), base_dir).replace(os.sep, '/')
+        for quirks in args.quirks:
+            manifest['jobs'].append({'rom': rom, 'quirks': quirks, 'cycles': args.cycles})
+    failures = run_manifest(manifest, base_dir, args.workers, args.translate, args.update)
+    if args.add or args.update:
+        save_manifest(manifest, args.manifest)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import struct
+import zlib
+from collections import deque
+
+#Save states: the whole machine state of a core as a compact, versioned bytes object
+#Layout (after the magic and version, zlib compressed):
+#  registers: quirks, PC, I, timers, cycles, FX0A and vblank waits, CXNN's seed, V0-VF, stack
+#  rng: state of CXNN's random number generator
+#  display: 32 rows of 64 bits
+#  ram: 4096 bytes
+#Restoring one puts the core exactly where it was, so a run can be continued from it
+
+MAGIC = b'C8SS'
+VERSION = 2
+#Quirk flags, in bit order. Only ever append to it, or old states will load with the wrong quirks
+QUIRKS = ('vf_reset', 'memory', 'display_wait', 'clipping', 'shifting', 'jumping')
+
+header_format = struct.Struct('<4sB')
+#Quirk flags, PC, I, delay timer, sound timer, cycles, idle cycles, wait flags, FX0A's release count,
+#CXNN's seed, stack depth
+registers_format = struct.Struct('<BHIBBQQBQQH')
+#Mersenne Twister's 624 words and its position in them. CXNN only uses randrange, so the state's
+#cached gaussian is always None and isn't saved
+rng_format = struct.Struct('<625I')
+rows_format = struct.Struct('<32Q')
+
+#Wait flags
+VBLANK_WAIT = 1
+KEY_WAIT = 2
+
+#RAM and the random number generator's state are compared in pages when recording deltas
+PAGE_SIZE = 64
+PAGES = 4096 // PAGE_SIZE
+RNG_PAGES = -(-rng_format.size // PAGE_SIZE)
+
+def pack_registers(core):
+    quirks = sum(1 << bit for bit, name in enumerate(QUIRKS) if core.quirks.get(name))
+    waits = (VBLANK_WAIT if core.vblank_wait else 0) | (KEY_WAIT if core.key_wait is not None else 0)
+    return registers_format.pack(
+        quirks, core.pc, core.r_i, core.delay_timer.timer, core.sound_timer.timer,
+        core.cycles, core.idle_cycles, waits, core.key_wait or 0, core.rng_seed, len(core.stack)
+    ) + bytes(core.r_v) + struct.pack(f'<{len(core.stack)}H', *core.stack)
+
+#Returns the offset right after the registers
+def unpack_registers(core, data, offset=0):
+    (quirks, core.pc, core.r_i, core.delay_timer.timer, core.sound_timer.timer, core.cycles, core.idle_cycles,
+        waits, key_wait, core.rng_seed, depth) = registers_format.unpack_from(data, offset)
+    offset += registers_format.size
+    core.vblank_wait = bool(waits & VBLANK_WAIT)
+    core.key_wait = key_wait if waits & KEY_WAIT else None
+    core.r_v = list(data[offset:offset+16])
+    offset += 16
+    core.stack = list(struct.unpack_from(f'<{depth}H', data, offset))
+    offset += 2*depth
+
+    quirks = {name: bool(quirks & (1 << bit)) for bit, name in enumerate(QUIRKS)}
+    if quirks != {name: bool(core.quirks.get(name)) for name in QUIRKS}:
+        #Quirks are baked into the handlers, so they need building again
+        core.quirks = dict(core.quirks, **quirks)
+        core.build_quirk_ops()
+    return offset
+
+def pack_rng(core):
+    version, words, gauss_next = core.rng.getstate()
+    return rng_format.pack(*words)
+
+def unpack_rng(core, data, offset=0):
+    core.rng.setstate((3, rng_format.unpack_from(data, offset), None))
+    return offset + rng_format.size
+
+def snapshot(core):
+    body = pack_registers(core) + pack_rng(core) + rows_format.pack(*core.display_data) + bytes(core.ram)
+    return header_format.pack(MAGIC, VERSION) + zlib.compress(body)
+
+#The core has to be configured, but doesn't need to have been reset: a batch run can jump
+#straight to a saved point
+def restore(core, data):
+    magic, version = header_format.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a save state")
+    if version != VERSION:
+        raise ValueError(f"Unsupported save state version {version}, expected {VERSION}")
+    body = zlib.decompress(data[header_format.size:])
+    if core.display_data is None:
+        core.init_screen()
+    if core.ram is None:
+        core.init_ram()
+    offset = unpack_registers(core, body)
+    offset = unpack_rng(core, body, offset)
+    core.display_data[:] = rows_format.unpack_from(body, offset)
+    offset += rows_format.size
+    core.ram[:] = body[offset:offset+4096]
+    after_restore(core)
+
+#The translated blocks were built from the old RAM, and the display still shows the old frame
+def after_restore(core):
+    if core.blocks is not None:
+        core.blocks.clear()
+    core.update_display()
+
+#Rewind history, one entry per recorded frame
+#Entries are grouped behind a keyframe (a full snapshot); every other entry only holds the
+#registers plus the RAM pages and display rows that changed since the entry before it.
+#Restoring an entry restores its keyframe and applies the deltas after it, so keyframe_every
+#bounds how much work that is. The oldest group is dropped once capacity frames are stored
+class Rewind:
+    capacity = None #Frames
+    keyframe_every = None #Frames
+    groups = None #[keyframe, delta, ...]
+    count = 0 #Frames stored
+
+    #State at the last recorded entry, to diff the next one against
+    last_ram = None
+    last_rng = None
+    last_rows = None
+
+    def __init__(self, capacity=60*60*5, keyframe_every=60):
+        self.capacity = capacity
+        self.keyframe_every = keyframe_every
+        self.clear()
+
+    def clear(self):
+        self.groups = deque()
+        self.count = 0
+        self.last_ram = None
+        self.last_rng = None
+        self.last_rows = None
+
+    def __len__(self):
+        return self.count
+
+    #Bytes used by the stored entries
+    def size(self):
+        return sum(len(entry) for group in self.groups for entry in group)
+
+    #Call once per frame
+    def record(self, core):
+        if self.last_ram is None or len(self.groups[-1]) >= self.keyframe_every:
+            self.groups.append([snapshot(core)])
+        else:
+            self.groups[-1].append(self.delta(core))
+        self.count += 1
+        self.last_ram = bytes(core.ram)
+        self.last_rng = pack_rng(core)
+        self.last_rows = list(core.display_data)
+        while self.count > self.capacity:
+            self.count -= len(self.groups.popleft())
+
+    #Pages of data that differ from last, as (mask, [page, ...])
+    @staticmethod
+    def changed_pages(data, last, count):
+        page_mask = 0
+        pages = []
+        for page in range(count):
+            start = page*PAGE_SIZE
+            chunk = data[start:start+PAGE_SIZE]
+            if chunk != last[start:start+PAGE_SIZE]:
+                page_mask |= 1 << page
+                pages.append(chunk)
+        return page_mask, pages
+
+    def delta(self, core):
+        #The generator's words only change every 624 numbers, CXNN mostly just moves its position
+        page_mask, pages = self.changed_pages(core.ram, self.last_ram, PAGES)
+        rng_mask, rng_pages = self.changed_pages(pack_rng(core), self.last_rng, RNG_PAGES)
+        row_mask = 0
+        rows = []
+        for y, (row, last_row) in enumerate(zip(core.display_data, self.last_rows)):
+            if row != last_row:
+                row_mask |= 1 << y
+                rows.append(row)
+        return zlib.compress(
+            pack_registers(core) + struct.pack('<QIQ', page_mask, row_mask, rng_mask)
+            + b''.join(pages) + struct.pack(f'<{len(rows)}Q', *rows) + b''.join(rng_pages)
+        )
+
+    def apply_delta(self, core, data):
+        data = zlib.decompress(data)
+        offset = unpack_registers(core, data)
+        page_mask, row_mask, rng_mask = struct.unpack_from('<QIQ', data, offset)
+        offset += 20
+        for page in range(PAGES):
+            if page_mask & (1 << page):
+                start = page*PAGE_SIZE
+                core.ram[start:start+PAGE_SIZE] = data[offset:offset+PAGE_SIZE]
+                offset += PAGE_SIZE
+        for y in range(32):
+            if row_mask & (1 << y):
+                core.display_data[y], = struct.unpack_from('<Q', data, offset)
+                offset += 8
+        if rng_mask:
+            rng = bytearray(pack_rng(core))
+            for page in range(RNG_PAGES):
+                if rng_mask & (1 << page):
+                    start = page*PAGE_SIZE
+                    end = min(start + PAGE_SIZE, len(rng))
+                    rng[start:end] = data[offset:offset+end-start]
+                    offset += end - start
+            unpack_rng(core, rng)
+
+    #Put the core in the state recorded frames entries ago (0 is the last one)
+    def restore_frame(self, core, frames=0):
+        if not 0 <= frames < self.count:
+            raise IndexError(f"Only {self.count} frames recorded")
+        index = self.count - 1 - frames
+        start = self.count
+        for group in reversed(self.groups):
+            start -= len(group)
+            if start <= index:
+                break
+        restore(core, group[0])
+        for data in group[1:index-start+1]:
+            self.apply_delta(core, data)
+        after_restore(core)
+
+    #Same as restore_frame, and forget everything recorded after it, so recording carries on from there
+    def rewind(self, core, frames=0):
+        self.restore_frame(core, frames)
+        self.count -= frames
+        while frames >= len(self.groups[-1]):
+            frames -= len(self.groups.pop())
+        if frames:
+            del self.groups[-1][-frames:]
+        self.last_ram = bytes(core.ram)
+        self.last_rng = pack_rng(core)
+        self.last_rows = list(core.display_data)
@@ -0,0 +1,70 @@
+import time
+
+#Paces the core to real time one frame at a time
+#Every frame has a deadline on the monotonic clock, one period after the previous one. A frame
+#that finishes early sleeps until shortly before its deadline, then spins the rest of the way,
+#since sleeps can overshoot by a whole OS timer tick. A frame that finishes late doesn't move
+#the deadlines, so the following frames wait less and the lost time is repaid, but only up to
+#max_catch_up frames: further behind than that, the missed frames are dropped and counted
+class FrameScheduler:
+    period = None #Seconds
+    spin = None #Seconds spun instead of slept before each deadline
+    max_catch_up = None #Frames
+
+    deadline = None
+
+    #Statistics
+    frames = 0
+    late_frames = 0 #Finished after their deadline, repaid later
+    missed_frames = 0 #Dropped because the core was too far behind
+    max_lateness = 0 #Seconds
+    sleep_time = 0 #Seconds spent waiting for deadlines, sleeping or spinning
+
+    def __init__(self, frame_hz=60, spin=0.002, max_catch_up=4):
+        self.period = 1./frame_hz
+        self.spin = spin
+        self.max_catch_up = max_catch_up
+
+    def start(self):
+        self.deadline = time.monotonic() + self.period
+        self.frames = 0
+        self.late_frames = 0
+        self.missed_frames = 0
+        self.max_lateness = 0
+        self.sleep_time = 0
+
+    #Wait for the end of the current frame, returns the time waited
+    def wait(self):
+        self.frames += 1
+        now = time.monotonic()
+        lateness = now - self.deadline
+        if lateness > 0:
+            self.late_frames += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+            missed = int(lateness / self.period)
+            if missed > self.max_catch_up:
+                #Give up on the frames that can't be repaid, the next one starts now
+                self.missed_frames += missed
+                self.deadline = now + self.period
+            else:
+                self.deadline += self.period
+            return 0
+
+        remaining = -lateness
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while time.monotonic() < self.deadline:
+            pass
+        waited = time.monotonic() - now
+        self.sleep_time += waited
+        self.deadline += self.period
+        return waited
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'late_frames': self.late_frames,
+            'missed_frames': self.missed_frames,
+            'max_lateness': self.max_lateness,
+            'sleep_time': self.sleep_time,
+        }
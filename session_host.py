@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from core import Core
+
+#Hosts many emulator sessions in one process, each one a coroutine on the same event loop
+#instead of a set of threads
+#A session runs one frame's worth of instructions at a time and yields to the loop in between,
+#so sessions take turns a frame each. Input goes in and frames come out through asyncio queues,
+#which makes it easy to put a network server (e.g. WebSockets) in front of the host
+
+#Keypad fed from a session's input queue, same interface as KB_Input
+class QueueInput:
+    keys = 0
+    release_count = 0
+    last_released = None
+
+    #Events are ('press', key) or ('release', key)
+    def apply(self, event):
+        action, key = event
+        if action == 'press':
+            self.keys |= 1 << key
+        elif action == 'release':
+            self.keys &= ~(1 << key)
+            self.last_released = key
+            self.release_count += 1
+
+class Session:
+    name = None
+    core = None
+    kb_input = None
+    input = None #asyncio.Queue of input events
+    frames = None #asyncio.Queue of frames (copies of display_data), None once the session is over
+    task = None
+    error = None #Exception that ended the session, if any
+
+    #For cycles per second
+    sample_cycles = 0
+    sample_time = None
+
+    def __init__(self, name, core, frame_buffer=2):
+        self.name = name
+        self.core = core
+        self.kb_input = QueueInput()
+        core.kb_input = self.kb_input
+        self.input = asyncio.Queue()
+        self.frames = asyncio.Queue(frame_buffer)
+        self.sample_time = time.perf_counter()
+
+    #Viewers only care about the newest frames, so the oldest one goes when nobody keeps up
+    def put_frame(self, frame):
+        if self.frames.full():
+            self.frames.get_nowait()
+        self.frames.put_nowait(frame)
+
+    #Frames on the core's clock, paced to the wall clock when throttled
+    async def run(self, frame_hz, throttle, max_catch_up):
+        core = self.core
+        loop = asyncio.get_running_loop()
+        period = 1./frame_hz
+        deadline = loop.time() + period
+        last_frame = None
+        try:
+            while True:
+                while not self.input.empty():
+                    self.kb_input.apply(self.input.get_nowait())
+                core.run_frames(1)
+                if core.display_data != last_frame:
+                    last_frame = list(core.display_data)
+                    self.put_frame(last_frame)
+
+                if not throttle:
+                    #Still let the other sessions have a frame
+                    await asyncio.sleep(0)
+                    continue
+                now = loop.time()
+                if now - deadline > max_catch_up*period:
+                    #Too far behind to catch up, start over from now
+                    deadline = now
+                await asyncio.sleep(max(deadline - now, 0))
+                deadline += period
+        except Exception as e:
+            logging.error(f"Session {self.name} crashed: {e}")
+            self.error = e
+        finally:
+            self.put_frame(None)
+
+    #Cycles per second since the last call
+    def cps(self):
+        now = time.perf_counter()
+        cps = (self.core.cycles - self.sample_cycles) / (now - self.sample_time)
+        self.sample_cycles = self.core.cycles
+        self.sample_time = now
+        return cps
+
+class SessionHost:
+    frame_hz = None
+    throttle = None
+    max_catch_up = None #Frames
+    sessions = None #Name -> Session
+
+    def __init__(self, frame_hz=60, throttle=True, max_catch_up=4):
+        self.frame_hz = frame_hz
+        self.throttle = throttle
+        self.max_catch_up = max_catch_up
+        self.sessions = {}
+
+    #Must be called from the event loop
+    def start(self, name, rom, quirks:dict, **settings):
+        if name in self.sessions:
+            raise ValueError(f"Session {name} already exists")
+        core = Core(display_hz=self.frame_hz)
+        core.load(rom)
+        core.configure(quirks, throttle=False, **settings)
+        core.reset()
+        session = Session(name, core)
+        session.task = asyncio.create_task(
+            session.run(self.frame_hz, self.throttle, self.max_catch_up), name=f"session {name}"
+        )
+        self.sessions[name] = session
+        return session
+
+    async def stop(self, name):
+        session = self.sessions.pop(name)
+        session.task.cancel()
+        try:
+            await session.task
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        for name in list(self.sessions):
+            await self.stop(name)
+
+    #Cycles per second of every session since the last call
+    def stats(self):
+        return {name: session.cps() for name, session in self.sessions.items()}
+
+async def serve(rom, quirks, sessions, seconds, throttle):
+    host = SessionHost(throttle=throttle)
+    for i in range(sessions):
+        host.start(f"{i}", rom, quirks, seed=i)
+    host.stats()
+    await asyncio.sleep(seconds)
+    stats = host.stats()
+    await host.close()
+    for name, cps in stats.items():
+        print(f"session {name:>4}: {cps:12,.0f} cps")
+    print(f"total: {sum(stats.values()):,.0f} cps over {sessions} sessions")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many sessions of a ROM in one event loop")
+    parser.add_argument('rom')
+    parser.add_argument('--sessions', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--unthrottled', action='store_true', help="Run every session as fast as possible")
+    args = parser.parse_args()
+    with open(args.rom, 'rb') as file:
+        rom = file.read()
+    asyncio.run(serve(rom, dict(Core.quirks), args.sessions, args.seconds, not args.unthrottled))
+
+if __name__ == '__main__':
+    main()
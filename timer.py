@@ -1,24 +1,12 @@
-import threading
-import time
-
+#Delay/sound timer, counts down at 60Hz
+#It has no thread of its own, the core ticks it every frame's worth of executed instructions,
+#so it stays in step with the program no matter how fast the core runs
 class Timer:
-    period = None
     timer = 0
 
-    #Settings
-    thread = None
-
-    def __init__(self, freq = 60):
-        self.period = 1./freq
-        thread = threading.Thread(target=self.countdown)
+    def __init__(self):
         self.timer = 0
-        thread.start()
-        
-    def countdown(self):
-        while True:
-            if self.timer > 0:
-                self.timer -= 1
-            time.sleep(self.period)
 
-    def cancel(self):
-        self.task.cancel()
\ No newline at end of file
+    def tick(self):
+        if self.timer > 0:
+            self.timer -= 1
@@ -0,0 +1,57 @@
+import struct
+
+#Compact binary trace of executed instructions, kept in a fixed-size ring buffer
+#so it can stay enabled during long runs
+class Tracer:
+    #pc, opcode, I, V0-VF
+    record_format = struct.Struct('<HHH16B')
+
+    capacity = None
+    buffer = None
+    count = 0 #Total records written, including overwritten ones
+
+    def __init__(self, capacity=0x10000):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity*self.record_format.size)
+        self.count = 0
+
+    def record(self, pc, inst, r_i, r_v):
+        self.record_format.pack_into(
+            self.buffer, (self.count % self.capacity)*self.record_format.size,
+            pc, inst, r_i & 0xFFFF, *r_v
+        )
+        self.count += 1
+
+    #Records still in the buffer (or only the last ones), oldest first
+    def records(self, last=None):
+        start = max(self.count - self.capacity, 0)
+        if last is not None:
+            start = max(self.count - last, start)
+        for i in range(start, self.count):
+            yield self.record_format.unpack_from(self.buffer, (i % self.capacity)*self.record_format.size)
+
+    def lines(self, last=None):
+        return [
+            f" inst={inst:04x}, PC={pc:x}, I={r_i:x}, V={bytes(r_v).hex(' ')}"
+            for pc, inst, r_i, *r_v in self.records(last)
+        ]
+
+    #Raw records, oldest first
+    def dump(self, file_name):
+        with open(file_name, 'wb') as file:
+            for record in self.records():
+                file.write(self.record_format.pack(*record))
+
+    def dump_text(self, file_name):
+        with open(file_name, 'w') as file:
+            file.write('\n'.join(self.lines()))
+
+    #Read records back from a file written by dump
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, 'rb') as file:
+            data = file.read()
+        tracer = cls(max(len(data) // cls.record_format.size, 1))
+        for pc, inst, r_i, *r_v in cls.record_format.iter_unpack(data):
+            tracer.record(pc, inst, r_i, r_v)
+        return tracer
@@ -0,0 +1,170 @@
+#Dynamic recompiler for the core
+#Straight-line runs of instructions are translated once into a generated Python function
+#and cached by their start address, so the core can run a whole block per dispatch
+#instead of a single instruction
+
+#Longest block, so a block always fits comfortably in a frame's worth of instructions
+MAX_BLOCK_LENGTH = 32
+#Size of the RAM pages used to find which blocks a write touches
+PAGE_BITS = 5
+
+class Block:
+    run = None #run(core, r_v, ram, ops)
+    start = None
+    end = None #Address right after the last instruction
+    length = None #Number of instructions, every instruction runs exactly once per call
+    last_inst = None
+    timed = False #Whether it reads or writes a timer, or ends waiting for vblank
+
+    def __init__(self, run, start, end, length, last_inst, timed):
+        self.run = run
+        self.start = start
+        self.end = end
+        self.length = length
+        self.last_inst = last_inst
+        self.timed = timed
+
+class BlockCache:
+    core = None
+    blocks = None #Start address -> Block
+    pages = None #Page -> start addresses of the blocks covering it
+
+    def __init__(self, core):
+        self.core = core
+        self.blocks = {}
+        self.pages = {}
+
+    def get(self, pc):
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.translate(pc)
+            self.blocks[pc] = block
+            for page in range(pc >> PAGE_BITS, ((block.end - 1) >> PAGE_BITS) + 1):
+                self.pages.setdefault(page, set()).add(pc)
+        return block
+
+    #Drop every block with an instruction in ram[start:end], so self-modifying code stays correct
+    def invalidate(self, start, end):
+        for page in range(start >> PAGE_BITS, ((end - 1) >> PAGE_BITS) + 1):
+            starts = self.pages.get(page)
+            if not starts:
+                continue
+            for block_start in list(starts):
+                block = self.blocks.get(block_start)
+                if block is not None and block.start < end and start < block.end:
+                    del self.blocks[block_start]
+                    for block_page in range(block.start >> PAGE_BITS, ((block.end - 1) >> PAGE_BITS) + 1):
+                        self.pages[block_page].discard(block_start)
+
+    def clear(self):
+        self.blocks.clear()
+        self.pages.clear()
+
+    #Translation
+
+    def translate(self, start):
+        ram = self.core.ram
+        lines = []
+        pc = start
+        length = 0
+        inst = None
+        ended = False
+        timed = False
+        while not ended and length < MAX_BLOCK_LENGTH and pc + 1 < len(ram):
+            inst = (ram[pc] << 8) | ram[pc+1]
+            timed = timed or (inst & 0xF0FF) in (0xF007, 0xF015, 0xF018) or (
+                inst >> 12 == 0xD and self.core.quirks['display_wait'])
+            code, ended = self.translate_inst(inst, pc)
+            lines += code
+            pc += 2
+            length += 1
+        if not ended:
+            lines += ["core.r_i = i", f"core.pc = {pc:#x}"]
+        source = (
+            f"def block_{start:03x}(core, v, ram, ops):\n"
+            "    i = core.r_i\n"
+            + "".join(f"    {line}\n" for line in lines)
+        )
+        namespace = {}
+        exec(compile(source, f"<block {start:03x}>", "exec"), namespace)
+        return Block(namespace[f"block_{start:03x}"], start, pc, length, inst, timed)
+
+    #Python lines for one instruction, and whether it ends the block
+    #Mirrors the handlers in Core, with the quirks already resolved the same way
+    def translate_inst(self, inst, pc):
+        quirks = self.core.quirks
+        x = (inst >> 8) & 0xF #2nd digit
+        y = (inst >> 4) & 0xF #3rd digit
+        n = inst & 0xF #4th digit
+        nn = inst & 0xFF #3rd and 4th digits
+        nnn = inst & 0xFFF #2nd, 3rd and 4th digits
+        next_pc = pc + 2
+        match inst >> 12:
+            case 0x1 if 0 <= pc - nnn <= 4:
+                #Might close an idle loop, which the handler checks for
+                return ["core.r_i = i", f"core.pc = {next_pc:#x}", f"ops[{inst:#x}]()"], True
+            case 0x1:
+                return ["core.r_i = i", f"core.pc = {nnn:#x}"], True
+            case 0x2:
+                return ["core.r_i = i", f"core.stack.append({next_pc:#x})", f"core.pc = {nnn:#x}"], True
+            case 0x3:
+                return self.skip(f"v[{x}] == {nn}", next_pc), True
+            case 0x4:
+                return self.skip(f"v[{x}] != {nn}", next_pc), True
+            case 0x5 if n == 0:
+                return self.skip(f"v[{x}] == v[{y}]", next_pc), True
+            case 0x6:
+                return [f"v[{x}] = {nn}"], False
+            case 0x7:
+                return [f"v[{x}] = (v[{x}] + {nn}) & 0xFF"], False
+            case 0x8 if n in (0x0, 0x1, 0x2, 0x3):
+                op = ("", "|", "&", "^")[n]
+                code = [f"v[{x}] {op}= v[{y}]"]
+                if n != 0 and quirks['vf_reset']:
+                    code.append("v[15] = 0")
+                return code, False
+            case 0x8 if n == 0x4:
+                return [f"r = v[{x}] + v[{y}]", f"v[{x}] = r & 0xFF", "v[15] = r >> 8"], False
+            case 0x8 if n == 0x5:
+                return [f"r = v[{x}] - v[{y}]", f"v[{x}] = r & 0xFF", "v[15] = 0 if r < 0 else 1"], False
+            case 0x8 if n == 0x6:
+                y = x if quirks['shifting'] else y
+                return [f"f = v[{y}] & 1", f"v[{x}] = v[{y}] >> 1", "v[15] = f"], False
+            case 0x8 if n == 0x7:
+                return [f"r = v[{y}] - v[{x}]", f"v[{x}] = r & 0xFF", "v[15] = 0 if r < 0 else 1"], False
+            case 0x8 if n == 0xE:
+                y = x if quirks['shifting'] else y
+                return [f"f = v[{y}] >> 7", f"v[{x}] = (v[{y}] << 1) & 0xFF", "v[15] = f"], False
+            case 0x9 if n == 0:
+                return self.skip(f"v[{x}] != v[{y}]", next_pc), True
+            case 0xA:
+                return [f"i = {nnn:#x}"], False
+            case 0xB:
+                x = x if quirks['jumping'] else 0
+                return ["core.r_i = i", f"core.pc = {nnn:#x} + v[{x}]"], True
+            case 0xC:
+                #Doesn't touch I or PC, so the handler can be called without syncing them
+                return self.call_unsynced(inst), False
+            case 0xF if nn == 0x1E:
+                return [f"i += v[{x}]"], False
+            case 0xF if nn == 0x29:
+                return [f"i = (v[{x}] % 0x10)*5"], False
+            case 0xF if nn == 0x65:
+                code = [f"v[0:{x+1}] = ram[i:i+{x+1}]"]
+                if quirks['memory']:
+                    code.append(f"i += {x+1}")
+                return code, False
+            case 0xF if nn in (0x07, 0x15, 0x18):
+                return self.call_unsynced(inst), False
+        #Everything else (display, input, returns, RAM writes, unexpected opcodes) goes through
+        #its handler and ends the block, since it can change the PC or the code itself
+        return ["core.r_i = i", f"core.pc = {next_pc:#x}", f"ops[{inst:#x}]()"], True
+
+    #An undecoded handler finds its opcode through the PC, so the ones called without syncing
+    #it have to be decoded already, and must not read the PC themselves
+    def call_unsynced(self, inst):
+        self.core.op(inst)
+        return [f"ops[{inst:#x}]()"]
+
+    def skip(self, condition, next_pc):
+        return ["core.r_i = i", f"core.pc = {next_pc+2:#x} if {condition} else {next_pc:#x}"]
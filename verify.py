@@ -0,0 +1,194 @@
+import argparse
+import sys
+from itertools import zip_longest
+
+from core import Core
+from rom_runner import QUIRK_SETS
+
+#Runs the reference interpreter and a faster engine side by side on the same ROM and checks
+#that they stay in the same state
+#The reference is Core without fast forwarding: one instruction per dispatch, with no idle loop
+#or vblank wait skipped in bulk, so it can't share a bug with the shortcuts the engines take
+#Both run the same number of cycles between checkpoints; at each one the selected parts of
+#their state are copied out and compared field by field. Copying RAM and the display costs
+#about as much as comparing them, so checkpoints a few hundred cycles apart keep long runs
+#cheap. The report has every field that differs and the instructions the reference ran
+#since the last checkpoint that matched
+#Engines:
+#  blocks: Core with block translation. Blocks only run when they fit before the next
+#    checkpoint, so checkpoints should be further apart than a block is long (32 instructions).
+#    With --every 1 only blocks of a single instruction ever run, which leaves the translator
+#    mostly untested
+#  batch: a single instance of BatchCore. Its CXNN uses another generator, so ROMs that use it
+#    won't match
+
+FIELDS = ('pc', 'i', 'v', 'stack', 'timers', 'ram', 'display')
+
+class CoreEngine:
+    core = None
+
+    def __init__(self, rom, quirks, seed=0, translate=False, fast_forward=True):
+        self.core = Core()
+        self.core.load(rom)
+        self.core.configure(quirks, throttle=False, translate=translate, seed=seed, fast_forward=fast_forward)
+        self.core.reset()
+
+    def run_cycles(self, n):
+        self.core.run_cycles(n)
+
+    @property
+    def cycles(self):
+        return self.core.cycles
+
+    def state(self):
+        core = self.core
+        return {
+            'pc': core.pc,
+            'i': core.r_i,
+            'v': tuple(core.r_v),
+            'stack': tuple(core.stack),
+            'timers': (core.delay_timer.timer, core.sound_timer.timer),
+            'ram': bytes(core.ram),
+            'display': tuple(core.display_data),
+        }
+
+class BatchEngine:
+    batch = None
+
+    def __init__(self, rom, quirks, seed=0):
+        from batch import BatchCore
+        self.batch = BatchCore(1, quirks, seeds=[seed])
+        self.batch.load(rom)
+        self.batch.reset()
+
+    def run_cycles(self, n):
+        self.batch.run_cycles(n)
+
+    @property
+    def cycles(self):
+        return self.batch.cycles
+
+    def state(self):
+        batch = self.batch
+        return {
+            'pc': int(batch.pc[0]),
+            'i': int(batch.r_i[0]),
+            'v': tuple(int(v) for v in batch.r_v[0]),
+            'stack': tuple(int(address) for address in batch.stack[0, :batch.sp[0]]),
+            'timers': (int(batch.delay_timer[0]), int(batch.sound_timer[0])),
+            'ram': batch.ram[0].tobytes(),
+            'display': tuple(batch.display_rows(0)),
+        }
+
+ENGINES = {
+    'blocks': lambda rom, quirks, seed: CoreEngine(rom, quirks, seed, translate=True),
+    'batch': BatchEngine,
+}
+
+def byte(value, spec='02x'):
+    return "--" if value is None else format(value, spec)
+
+#Human readable differences between two states, one line each
+#A crashing instruction can leave V or RAM shorter or longer than usual (e.g. FX65 reading past
+#the end of RAM), what's missing on one side shows as --
+def diff(expected, actual, fields):
+    lines = []
+    for field in fields:
+        a = expected[field]
+        b = actual[field]
+        if a == b:
+            continue
+        if field == 'ram':
+            changes = [(address, x, y) for address, (x, y) in enumerate(zip_longest(a, b)) if x != y]
+            lines.append(f"ram: {len(changes)} bytes differ")
+            lines += [f"  {address:#05x}: {byte(x)} != {byte(y)}" for address, x, y in changes[:16]]
+        elif field == 'display':
+            lines += [f"display row {y:2}: {row_a:064b}\n            != {row_b:064b}"
+                for y, (row_a, row_b) in enumerate(zip(a, b)) if row_a != row_b]
+        elif field == 'v':
+            lines += [f"V{x:X}: {byte(v, '#04x')} != {byte(w, '#04x')}" for x, (v, w) in enumerate(zip_longest(a, b)) if v != w]
+        else:
+            lines.append(f"{field}: {a} != {b}")
+    return lines
+
+#Returns None when both engines matched for the whole run, or a report of the first mismatch
+def verify(rom, quirks, engine='blocks', cycles=100_000, every=256, fields=FIELDS, seed=0):
+    reference = CoreEngine(rom, quirks, seed, fast_forward=False)
+    fast = ENGINES[engine](rom, quirks, seed)
+    ref_core = reference.core
+    while reference.cycles < cycles:
+        n = min(every, cycles - reference.cycles)
+        start = reference.cycles
+        #The reference goes one instruction at a time, keeping track of what it ran
+        ran = []
+        ref_error = fast_error = None
+        try:
+            for _ in range(n):
+                pc = ref_core.pc
+                ran.append((pc, (ref_core.ram[pc] << 8) | ref_core.ram[pc+1]))
+                ref_core.run_cycles(1)
+        except Exception as e:
+            ref_error = f"{type(e).__name__}: {e}"
+        try:
+            fast.run_cycles(n)
+        except Exception as e:
+            fast_error = f"{type(e).__name__}: {e}"
+
+        expected = reference.state()
+        actual = fast.state()
+        if ref_error is not None and fast_error is not None:
+            #Both crashed, they may have stopped at different points of the instruction, so only
+            #the errors are compared, and there's nothing left to run either way
+            if ref_error == fast_error:
+                return None
+            lines = [f"error: {ref_error} != {fast_error}"]
+        elif ref_error is not None or fast_error is not None:
+            lines = diff(expected, actual, fields) + [f"error: {ref_error} != {fast_error}"]
+        elif any(expected[field] != actual[field] for field in fields):
+            lines = diff(expected, actual, fields)
+        else:
+            continue
+        return {
+            'cycles': (start, reference.cycles),
+            'instructions': ran,
+            'diff': lines,
+        }
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a fast engine against the reference interpreter")
+    parser.add_argument('rom')
+    parser.add_argument('--engine', default='blocks', help=f"Engine to check, one of {', '.join(ENGINES)}")
+    parser.add_argument('--quirks', default='chip8', help=f"Quirk set, one of {', '.join(QUIRK_SETS)}")
+    parser.add_argument('--cycles', type=int, default=100_000)
+    parser.add_argument('--every', type=int, default=256, help="Cycles between comparisons")
+    parser.add_argument('--fields', default=','.join(FIELDS), help="State to compare, any of " + ', '.join(FIELDS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.engine not in ENGINES:
+        parser.error(f"unknown engine {args.engine}")
+    if args.quirks not in QUIRK_SETS:
+        parser.error(f"unknown quirk set {args.quirks}")
+    fields = args.fields.split(',')
+    for field in fields:
+        if field not in FIELDS:
+            parser.error(f"unknown field {field}")
+
+    with open(args.rom, 'rb') as file:
+        rom = file.read()
+    mismatch = verify(rom, QUIRK_SETS[args.quirks], args.engine, args.cycles, args.every, fields, args.seed)
+    if mismatch is None:
+        print(f"{args.engine} matched the reference for {args.cycles} cycles")
+        return
+    start, end = mismatch['cycles']
+    print(f"{args.engine} diverged from the reference between cycles {start} and {end}")
+    print("Reference ran:")
+    for pc, inst in mismatch['instructions']:
+        print(f"  {pc:#05x}: {inst:04X}")
+    print("Differences (reference != engine):")
+    for line in mismatch['diff']:
+        print(f"  {line}")
+    sys.exit(1)
+
+if __name__ == '__main__':
+    main()